@@ -1,9 +1,12 @@
 # Main script to extract time series of NIRv from Landsat 7 imagery on Google Earth Engine
 # (c) Zijian HUANG 2024
 
-import time
 import geopandas as gpd
+from functools import partial
 from ee_tools import *
+from chunk_planner import plan_chunks, print_chunk_summary, write_chunk_plan
+from export_scheduler import EarthEngineBackend, run_export_jobs
+from extraction_manifest import *
 
 # Initialize the Earth Engine module
 ee.Initialize()
@@ -17,6 +20,17 @@ export_path = r"./data"
 start_date = '1999-01-01'
 end_date = '2023-12-31'
 
+# Vegetation indices to calculate
+vi_list = ['ndvi', 'nirv']
+# 'image' reduces each image over all features of the chunk at once,
+# 'feature' reduces each feature over its images (both preprocess the collection once per chunk)
+engine = 'image'
+# Number of export tasks running at the same time
+max_tasks = 10
+# Drive folder of the exports, and the manifest recording their states for restarts
+drive_folder = 'Mangrove'
+manifest_path = f"{export_path}/ChinaMangrove_exports.json"
+
 # Read shapefile
 full_mangrove = gpd.read_file(shp0_path).to_crs("epsg:4326")
 
@@ -25,55 +39,75 @@ ic = ee.ImageCollection('LANDSAT/LE07/C02/T2_L2') \
     .select(['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7', 'QA_PIXEL'],
             ['blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'QA_PIXEL'])
 
-# split and process on every 40 features
-shp_idx = 0
-for i in range(0, len(full_mangrove), 40):
-    shp_idx += 1
+# split into chunks of similar cost, so that the tasks finish in similar times
+chunks, feature_costs = plan_chunks(full_mangrove)
+write_chunk_plan(chunks, feature_costs, f"{export_path}/ChinaMangrove_chunks.json")
+print_chunk_summary(chunks, feature_costs)
+
+manifest = load_run_manifest(manifest_path)
+export_jobs = []
+for shp_idx, chunk in enumerate(chunks, start=1):
+    # the same chunk with the same settings keeps its name over runs, so that finished exports are skipped
+    description = get_export_name(shp_idx, chunk, vi_list,
+                                  {'start_date': start_date, 'end_date': end_date, 'engine': engine})
+    register_export(manifest, description, shp_idx, chunk, vi_list, f"{drive_folder}/{description}.csv")
+    if is_export_completed(manifest, description):
+        print(f">> Chunk {shp_idx}: {description} already exported.")
+        continue
     # --- Get features ready
     # slice the geo-dataframe
-    gdf = full_mangrove.iloc[i:i+40]
+    gdf = full_mangrove.loc[chunk]
     # first export the sliced geo-dataframe into a new shapefile
     export_slice = f"ChinaMangrove_part_{shp_idx}.shp"
     gdf.to_file(f"{export_path}/{export_slice}", driver="ESRI Shapefile")
+    # build the feature collection once, shared by all indices
+    features, payload_size = prepare_feature_chunk(gdf)
+    print(f">> Chunk {shp_idx}: {len(gdf)} features, {payload_size / 1024:.1f} KB of request payload.")
     # --- Calculate indices based on features
-    # Iterate over each shapefile and process calculation of vegetation indices
-    for vi in ['ndvi', 'nirv']:
-        print(f'Processing #{i}/{len(full_mangrove)/40}')
-        # convert the geo-dataframe to a list of dictionaries
-        features = gdf.to_json()["features"]
-        # create a list of Earth Engine features
-        ee_features = []
-        for feature in features:
-            # extract geometry and properties
-            geometry = ee.Geometry.MultiPolygon(feature['geometry']['coordinates'])
-            properties = feature['properties']
-            # create an earth engine feature
-            ee_feature = ee.Feature(geometry, properties)
-            # append to the list
-            ee_features.append(ee_feature)
-        # create the feature collection
-        features = ee.FeatureCollection(ee_features)
-
-        # Calculate mean vegetation indices for each feature
+    # all indices are reduced together, in one table and one export task per chunk
+    print(f'Processing #{shp_idx}/{len(chunks)}')
+    # Calculate mean vegetation indices for each feature
+    if engine == 'image':
+        result = get_vi_time_series_by_image(
+            features=features,
+            image_collection=ic,
+            start_date=start_date,
+            end_date=end_date,
+            target=vi_list
+        )
+    else:
+        # the collection is preprocessed once for the chunk, and each feature selects its images from it
+        ic_chunk = get_chunk_collection(features, ic, start_date, end_date, vi_list)
         result = features.map(lambda f: get_vi_time_series(
             feature=f,
-            image_collection=ic,
+            image_collection=ic_chunk,
             start_date=start_date,
             end_date=end_date,
-            target=vi
-        ))
+            target=vi_list,
+            preprocessed=True
+        )).flatten()
 
-        # Export the result to a CSV file
-        task = ee.batch.Export.table.toDrive(
+    # Export the result to a CSV file, started by the scheduler below
+    export_jobs.append({
+        'name': description,
+        # a task still running from an interrupted run is waited for instead of started again
+        'task_id': get_resumable_task(manifest, description),
+        'make_task': partial(
+            ee.batch.Export.table.toDrive,
             collection=result,
-            description=f'Mean_NDVI_{shp_idx}',
-            folder='Mangrove',
+            description=description,
+            folder=drive_folder,
+            fileNamePrefix=description,
             fileFormat='CSV'
         )
-        task.start()
+    })
+save_run_manifest(manifest, manifest_path)
 
-        # Wait for a while before processing the next shapefile to avoid rate limits
-        time.sleep(30)  # Adjust the sleep time as necessary
+# Keep max_tasks exports running at a time, starting the next one as soon as one ends
+states = run_export_jobs(export_jobs, EarthEngineBackend(), max_in_flight=max_tasks,
+                         on_state=get_manifest_updater(manifest, manifest_path))
+failed = [name for name, state in states.items() if state != 'COMPLETED']
+if failed:
+    print(f"-! {len(failed)} exports failed: {', '.join(failed)}.")
 
 print('--All shapefiles processed.')
-
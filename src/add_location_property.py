@@ -1,81 +1,190 @@
+# Add the location state (protected / unprotected) to the points of the export tables from earth engine
+#
+# Each export table is written with its state, point ID, date, sensor and tile (Landsat only), file ID and
+# file name in the compact types of system_index.py, one row per index in columns vi and target (float32)
+# as arranged by arrange_ee_tables.py, into the output folder as
+# {output folder}/{table name}.parquet, read back as one table with pd.read_parquet(path) in Python, or
+# arrow::open_dataset(path) in R. The tables located are recorded in a manifest in the output folder
+# (see table_manifest.py), so a run into the same folder in incremental mode only reads the tables that are
+# new or changed since, and replaces their files only.
+#
+# A point repeats in the tables once per acquired date, so the state is looked up once per point, identified
+# by its point ID and location, and kept in a table of states in the output folder, named after the content
+# of the area layers, for the next tables and runs. The rows get the states of their points by a merge.
+
 import os
+import hashlib
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
+from arrange_ee_tables import melt_export_table, read_export_table
+from polygon_label_index import get_polygon_fingerprint
 from support_tools import get_files_from_folder, get_satellite_info
-
-# load the table of points
-# points_table = pd.read_csv(r"../data/vi_gee/Landsat/Mean_ndvi_1.csv")
-
-path_to_table = input("-- Please input the folder of point tables: ")
-csv_candidates = get_files_from_folder(path_to_table)
-
-satellite = get_satellite_info()
-
-export_csv_name = input("-- Please input the full path of the exported CSV file (ends with .csv): ")
-
-# initialize an empty list to hold the processed DataFrames
-processed_dfs = []
-
-# load the shapefile
-protected_area = gpd.read_file(r"../data/pa.shp")
-unprotected_area = gpd.read_file(r"../data/npa.shp")
-
-# process each csv file
-pbar = tqdm(total=len(csv_candidates), desc="Arranging tables")
-for csv in csv_candidates:
-    # load the table of points
-    points_table = pd.read_csv(os.path.join(path_to_table, csv))
-
-    # create a geo-dataframe from the points dataframe
-    geometry = [Point(xy) for xy in zip(points_table['lon'], points_table['lat'])]
-    points_gdf = gpd.GeoDataFrame(points_table, geometry=geometry, crs="EPSG:4326")
-
-    # # Debug output: check crs
-    # print("CRS of points_gdf: ", points_gdf.crs)
-    # print("CRS of protected area: ", protected_area.crs)
-    # print("CRS of unprotected area: ", unprotected_area.crs)
-
-    # ensure the coordinate reference system (CRS) is the same for all geo-dataframes
-    points_gdf = points_gdf.to_crs(protected_area.crs)
-
-    # spatial join points with (un)protected areas
-    protected_points = gpd.sjoin(points_gdf, protected_area, how="left", predicate="within")
-    unprotected_points = gpd.sjoin(points_gdf, unprotected_area, how="left", predicate="within")
-
-    # initialize the location column with None
-    points_gdf['state'] = None
-
-    # set state to (un)protected where points are within (un)protected areas
-    protected_indices = protected_points[protected_points.index_right.notnull()].index
-    points_gdf.loc[protected_indices, 'state'] = 'protected'
-    unprotected_indices = unprotected_points[unprotected_points.index_right.notnull()].index
-    points_gdf.loc[unprotected_indices, 'state'] = 'unprotected'
-
-    # create new columns for point ID and date
-    # split point ID and capture date from system:index
-    split_column = points_gdf['system:index'].str.split('_', expand=True)
-    if satellite == "Landsat":
-        # Landsat system:index format -> {Point ID}_{Product Abbr.}_{TIle ID}_{Acquired Date}
-        points_gdf['pointID'] = split_column[0]
-        points_gdf['date'] = pd.to_datetime(split_column[3], format='%Y%m%d')
-        points_gdf['filename'] = csv.split(".")[0]
-    else:
-        # MODIS system:index format -> {Point ID}_{Acquired Year}_{Acquired Month}_{Acquired Day}
-        points_gdf['pointID'] = split_column[0]
-        points_gdf['date'] = pd.to_datetime(split_column[1] + split_column[2] + split_column[3], format='%Y%m%d')
-        points_gdf['filename'] = csv.split(".")[0]
-
-    # append the processed data frame to the list
-    processed_dfs.append(points_gdf)
-    pbar.update(1)
-pbar.close()
-
-# concatenate all processed data frames
-combined_df = pd.concat(processed_dfs, ignore_index=True)
-
-# save the result
-combined_df.to_csv(export_csv_name, index=False)
-
-print(f">> Finish arranging all tables in given folder.")
+from system_index import CATEGORY_TYPE, decode_system_index, get_category_column
+from table_manifest import ask_incremental, is_table_unchanged, load_table_manifest, report_bytes_per_row, \
+    save_table_manifest, update_table
+
+
+# columns identifying a point in the table of states
+POINT_COLUMNS = ['pointID', 'lon', 'lat']
+
+
+def get_path_to_location_states(protected_area, unprotected_area, path_to_output):
+    """
+    Names the table of states after the content of the area layers, so edited layers start a new table.
+    :return: (str) Path to the table of states in Parquet.
+    """
+    digest = hashlib.sha1((get_polygon_fingerprint(protected_area) +
+                           get_polygon_fingerprint(unprotected_area)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(path_to_output, f"_location_states_{digest}.parquet")
+
+
+def load_location_states(path_to_states):
+    """
+    :param (str) path_to_states: Path to the table of states in Parquet.
+    :return: (pd.DataFrame) States of the points located so far, by point ID, lon and lat.
+    """
+    if not os.path.exists(path_to_states):
+        return pd.DataFrame({'pointID': pd.Series(dtype=np.int32), 'lon': pd.Series(dtype=float),
+                             'lat': pd.Series(dtype=float), 'state': pd.Series(dtype=object)})
+    return pd.read_parquet(path_to_states).astype({'pointID': np.int32})
+
+
+def save_location_states(location_states, path_to_states):
+    # write to a temporary file first, so that an interruption never leaves a broken table
+    temporary_path = f"{path_to_states}.tmp"
+    location_states.to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, path_to_states)
+
+
+def locate_points(lon, lat, protected_area, unprotected_area):
+    """
+    Looks up the state of the points in the spatial index of each area layer.
+    :param (np.ndarray) lon: Longitudes of the points.
+    :param (np.ndarray) lat: Latitudes of the points.
+    :param (gpd.GeoDataFrame) protected_area: Protected areas.
+    :param (gpd.GeoDataFrame) unprotected_area: Unprotected areas, in the CRS of the protected areas.
+    :return: (np.ndarray) States of the points, protected, unprotected or None outside both.
+    """
+    # ensure the coordinate reference system (CRS) is the same for points and areas
+    points = gpd.GeoSeries(gpd.points_from_xy(lon, lat), crs="EPSG:4326").to_crs(protected_area.crs).values
+    states = np.full(len(points), None, dtype=object)
+    # points in both layers are taken as unprotected
+    for area, state in [(protected_area, 'protected'), (unprotected_area, 'unprotected')]:
+        point_positions, _ = area.sindex.query(points, predicate='within')
+        states[point_positions] = state
+    return states
+
+
+def get_location_states(points, location_states, protected_area, unprotected_area):
+    """
+    Gets the state of the points, locating the points missing from the table of states.
+    :param (pd.DataFrame) points: Point ID, lon and lat of the rows.
+    :param (pd.DataFrame) location_states: Table of states from load_location_states().
+    :param (gpd.GeoDataFrame) protected_area: Protected areas.
+    :param (gpd.GeoDataFrame) unprotected_area: Unprotected areas, in the CRS of the protected areas.
+    :return: (tuple) States of the rows (np.ndarray), the table of states with the new points, and the number
+        of new points.
+    """
+    unique_points = points.drop_duplicates()
+    known = unique_points.merge(location_states[POINT_COLUMNS], how='left', on=POINT_COLUMNS, indicator=True)
+    new_points = known.loc[known['_merge'] == 'left_only', POINT_COLUMNS]
+    if len(new_points):
+        new_states = locate_points(new_points['lon'].to_numpy(), new_points['lat'].to_numpy(),
+                                   protected_area, unprotected_area)
+        location_states = pd.concat([location_states, new_points.assign(state=new_states)], ignore_index=True)
+    # the table of states holds each point once, so the merge keeps the rows in order
+    states = points.merge(location_states, how='left', on=POINT_COLUMNS)['state'].to_numpy()
+    return states, location_states, len(new_points)
+
+
+def locate_table(path_to_table, satellite, protected_area, unprotected_area, path_to_output, location_states):
+    """
+    Adds the location state, point ID, date, sensor and tile (Landsat only), file ID and file name to the
+    points of an export table, melted into columns vi and target, and writes them into the output folder.
+    :param (str) path_to_table: Path to the CSV table, named as Mean_{indices}_{file ID}.csv.
+    :param (str) satellite: Landsat or MODIS.
+    :param (gpd.GeoDataFrame) protected_area: Protected areas.
+    :param (gpd.GeoDataFrame) unprotected_area: Unprotected areas, in the CRS of the protected areas.
+    :param (str) path_to_output: Output folder.
+    :param (dict) location_states: Table of states from load_location_states() in key table, and its path
+        in key path, updated with the new points of the table.
+    :return: (tuple) Name of the file written in the output folder, and the summary of the table.
+    """
+    table_prefix = os.path.basename(path_to_table).split(".")[0]
+    # load the table of points, without the columns dropped by arrange_ee_tables.py such as .geo
+    points_table, value_columns = read_export_table(path_to_table)
+
+    # point ID, date, and for Landsat sensor and tile, from system:index, which is not kept
+    decoded = decode_system_index(points_table['system:index'], satellite)
+
+    # state of the points (un)protected, None outside both areas
+    states, location_states['table'], num_new_points = get_location_states(
+        pd.DataFrame({'pointID': decoded['pointID'].to_numpy(),
+                      'lon': points_table['lon'].to_numpy(), 'lat': points_table['lat'].to_numpy()}),
+        location_states['table'], protected_area, unprotected_area)
+    if num_new_points:
+        save_location_states(location_states['table'], location_states['path'])
+
+    # one row per index in columns vi and target, as arranged by arrange_ee_tables.py
+    located = melt_export_table(points_table, value_columns, {
+        'fileID': get_category_column(table_prefix.split("_")[2], points_table.num_rows),
+        **decoded,
+        'lat': points_table['lat'],
+        'lon': points_table['lon'],
+        'state': pa.array(states, pa.string(), from_pandas=True).dictionary_encode().cast(CATEGORY_TYPE),
+        'filename': get_category_column(table_prefix, points_table.num_rows)
+    })
+
+    output = f"{table_prefix}.parquet"
+    temporary_path = os.path.join(path_to_output, f".{output}.tmp")
+    pq.write_table(located, temporary_path)
+    os.replace(temporary_path, os.path.join(path_to_output, output))
+    return [output], {
+        'rows': located.num_rows,
+        'bytes_read': points_table.nbytes,
+        'bytes_arranged': located.nbytes
+    }
+
+
+if __name__ == '__main__':
+    path_to_table = input("-- Please input the folder of point tables: ")
+    csv_candidates = get_files_from_folder(path_to_table)
+
+    satellite = get_satellite_info()
+
+    export_folder = input("-- Please input the folder of the exported Parquet tables: ")
+    os.makedirs(export_folder, exist_ok=True)
+    incremental = ask_incremental()
+    manifest = load_table_manifest(export_folder)
+    if incremental:
+        csv_candidates = [csv for csv in csv_candidates
+                          if not is_table_unchanged(manifest.get(csv), os.path.join(path_to_table, csv))]
+        print(f">> {len(csv_candidates)} new or changed CSV files to locate.")
+
+    # load the shapefile
+    protected_area = gpd.read_file(r"../data/pa.shp")
+    unprotected_area = gpd.read_file(r"../data/npa.shp").to_crs(protected_area.crs)
+    path_to_states = get_path_to_location_states(protected_area, unprotected_area, export_folder)
+    location_states = {'table': load_location_states(path_to_states), 'path': path_to_states}
+    print(f">> {len(location_states['table'])} points located in earlier runs.")
+
+    # process each csv file
+    located_tables = []
+    for csv in tqdm(csv_candidates, desc="Arranging tables"):
+        located, manifest[csv] = update_table(
+            os.path.join(path_to_table, csv), manifest.get(csv),
+            lambda path: locate_table(path, satellite, protected_area, unprotected_area, export_folder,
+                                      location_states),
+            export_folder, not incremental)
+        if located:
+            located_tables.append(csv)
+        # saved after every table, so an interrupted run keeps the tables located so far
+        save_table_manifest(manifest, export_folder)
+
+    report_bytes_per_row([manifest[csv] for csv in located_tables])
+    print(f">> Finish arranging all tables in given folder, {len(located_tables)} tables written to "
+          f"{export_folder}.")
@@ -1,60 +1,144 @@
 # Arrange csv tables from earth engine
 # (c) Zijian HUANG 2024
+#
+# The export tables are read in parallel with the CSV reader of PyArrow, keeping only the columns in use, and
+# each table is written on its own into a Parquet dataset partitioned by index and year, e.g.
+#   {export folder}/vi=ndvi/year=2001/Mean_ndvi_1-0.parquet
+# so the arranged rows are never gathered in memory. The rows hold an int32 point ID, categorical file ID,
+# sensor and tile (Landsat only), dates as date32 and float32 values, see system_index.py.
+# The dataset is read back as one table with pyarrow.dataset.dataset(path, partitioning='hive') in Python,
+# or arrow::open_dataset(path) in R.
+# The tables arranged are recorded in a manifest in the dataset folder (see table_manifest.py), so a run into
+# the same folder in incremental mode only reads the tables that are new or changed since, and replaces
+# their files only.
 
 import os
 import time
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from support_tools import get_files_from_folder, get_satellite_info
+from system_index import decode_system_index, get_category_column
+from table_manifest import ask_incremental, is_table_unchanged, load_table_manifest, report_bytes_per_row, \
+    save_table_manifest, update_table
 
+# number of tables read at the same time
+NUM_THREADS = min(8, os.cpu_count() or 1)
 
-# load the export csv files from earth engine
-path_to_csv = input("-- Please input the folder of point tables: ")
-csv_candidates = get_files_from_folder(path_to_csv)
-
-satellite = get_satellite_info()
-
-export_csv_name = input("-- Please input the full path of the exported CSV file (ends with .csv): ")
-
-# REPORT
-print(f">> Task starts at {time.strftime('%H:%M:%S', time.localtime())}.")
-
-# initialize an empty list to hold the processed DataFrames
-processed_dfs = []
-pbar = tqdm(total=len(csv_candidates), desc="Arranging tables")
-for csv in csv_candidates:
-    # file ID
-    table_prefix = csv.split(".")[0]
-    table_name_split = table_prefix.split("_")
-    vi = table_name_split[1]
-    file_id = table_name_split[2]
-    # load the table
-    result_table = pd.read_csv(os.path.join(path_to_csv, csv))
-    # create new columns for point ID and date
-    split_column = result_table['system:index'].str.split('_', expand=True)
-    if satellite == "Landsat":
-        # Landsat {system:index} format -> {Point ID}_{Product Abbr.}_{TIle ID}_{Acquired Date}
-        result_table['pointID'] = split_column[0]
-        result_table['date'] = pd.to_datetime(split_column[3], format='%Y%m%d')
-        result_table['vi'] = vi
-        result_table['fileID'] = file_id
-    else:
-        # MODIS {system:index{ format -> {Point ID}_{Acquired Date}
-        result_table['pointID'] = split_column[0]
-        result_table['date'] = pd.to_datetime(split_column[1] + split_column[2] + split_column[3], format='%Y%m%d')
-        result_table['vi'] = vi
-        result_table['fileID'] = file_id
-
-    # append the processed data frame to the list
-    export_table = result_table[['fileID', 'pointID', 'vi', 'lat', 'lon', 'date', 'target']]
-    processed_dfs.append(export_table)
-    pbar.update(1)
-pbar.close()
-
-# concatenate all processed data frames
-combined_df = pd.concat(processed_dfs, ignore_index=True)
-
-# output to disk
-combined_df.to_csv(export_csv_name, index=False)
-
-print(">> Finish arranging all tables in given folder.")
+# layout of the dataset, the partition columns are kept in the folder names, not in the files
+PARTITIONING = ds.partitioning(pa.schema([('vi', pa.string()), ('year', pa.int32())]), flavor='hive')
+
+
+def read_export_table(path_to_table):
+    """
+    Reads only the columns in use from an export table of earth engine.
+    Tables of one index hold the values in column target, tables of several indices (named as
+    Mean_ndvi-nirv_1.csv) hold one column per index.
+    :param (str) path_to_table: Path to the CSV table, named as Mean_{indices}_{file ID}.csv.
+    :return: (tuple) pyarrow.Table, and the names of the value columns with the index of each.
+    """
+    vi = os.path.basename(path_to_table).split(".")[0].split("_")[1]
+    with open(path_to_table) as f:
+        header = f.readline().strip().split(",")
+    value_columns = {'target': vi} if 'target' in header else {name: name for name in vi.split('-')}
+    column_types = {'system:index': pa.string(), 'lat': pa.float64(), 'lon': pa.float64()}
+    column_types.update({name: pa.float64() for name in value_columns})
+    table = pv.read_csv(path_to_table,
+                        # the tables are read in parallel already
+                        read_options=pv.ReadOptions(use_threads=False),
+                        convert_options=pv.ConvertOptions(include_columns=list(column_types),
+                                                          column_types=column_types))
+    return table, value_columns
+
+
+def melt_export_table(table, value_columns, columns):
+    """
+    Melts the value columns of an export table into columns vi and target, one block of rows per index.
+    :param (pa.Table) table: Export table from read_export_table().
+    :param (dict) value_columns: Names of the value columns with the index of each, from read_export_table().
+    :param (dict) columns: Other columns of the rows by name, repeated in every block.
+    :return: (pa.Table) The columns, vi (categorical) and target (float32).
+    """
+    return pa.concat_tables([pa.table({
+        **columns,
+        'vi': get_category_column(vi, table.num_rows),
+        'target': table[column].cast(pa.float32())
+    }) for column, vi in value_columns.items()])
+
+
+def arrange_table(path_to_table, satellite, path_to_dataset):
+    """
+    Arranges an export table into rows of [fileID, pointID, (sensor, tile,) date, lat, lon, vi, target],
+    and writes them into the Parquet dataset.
+    :param (str) path_to_table: Path to the CSV table, named as Mean_{indices}_{file ID}.csv.
+    :param (str) satellite: Landsat or MODIS.
+    :param (str) path_to_dataset: Folder of the Parquet dataset.
+    :return: (tuple) Paths to the files written, relative to the dataset folder, and the summary of the table.
+    """
+    table_prefix = os.path.basename(path_to_table).split(".")[0]
+    file_id = table_prefix.split("_")[2]
+    table, value_columns = read_export_table(path_to_table)
+    decoded = decode_system_index(table['system:index'], satellite)
+    arranged = melt_export_table(table, value_columns, {
+        'fileID': get_category_column(file_id, table.num_rows),
+        **decoded,
+        'lat': table['lat'],
+        'lon': table['lon'],
+        'year': pc.year(decoded['date']).cast(pa.int32())
+    })
+    outputs = []
+    ds.write_dataset(arranged, path_to_dataset, format='parquet', partitioning=PARTITIONING,
+                     basename_template=f"{table_prefix}-{{i}}.parquet",
+                     existing_data_behavior='overwrite_or_ignore',
+                     file_visitor=lambda written: outputs.append(os.path.relpath(written.path, path_to_dataset)))
+    return outputs, {
+        'rows': arranged.num_rows,
+        'bytes_read': table.nbytes,
+        # the partition columns are kept in the folder names
+        'bytes_arranged': arranged.drop_columns(['vi', 'year']).nbytes
+    }
+
+
+if __name__ == '__main__':
+    # load the export csv files from earth engine
+    path_to_csv = input("-- Please input the folder of point tables: ")
+    csv_candidates = get_files_from_folder(path_to_csv)
+
+    satellite = get_satellite_info()
+
+    export_folder = input("-- Please input the folder of the exported Parquet dataset: ")
+    os.makedirs(export_folder, exist_ok=True)
+    incremental = ask_incremental()
+    manifest = load_table_manifest(export_folder)
+    if incremental:
+        csv_candidates = [csv for csv in csv_candidates
+                          if not is_table_unchanged(manifest.get(csv), os.path.join(path_to_csv, csv))]
+        print(f">> {len(csv_candidates)} new or changed CSV files to arrange.")
+
+    # REPORT
+    print(f">> Task starts at {time.strftime('%H:%M:%S', time.localtime())}.")
+
+    arranged_tables = []
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        futures = {executor.submit(update_table, os.path.join(path_to_csv, csv), manifest.get(csv),
+                                   lambda path: arrange_table(path, satellite, export_folder), export_folder,
+                                   not incremental): csv
+                   for csv in csv_candidates}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Arranging tables"):
+            csv = futures[future]
+            try:
+                arranged, manifest[csv] = future.result()
+            except Exception as e:
+                print(f"-! Failed to arrange {csv}: {e}")
+                continue
+            if arranged:
+                arranged_tables.append(csv)
+            # saved after every table, so an interrupted run keeps the tables arranged so far
+            save_table_manifest(manifest, export_folder)
+
+    report_bytes_per_row([manifest[csv] for csv in arranged_tables])
+    print(f">> Finish arranging all tables in given folder, {len(arranged_tables)} tables written to "
+          f"{export_folder}.")
@@ -0,0 +1,87 @@
+# Compare the engines of the VI time series on a mock of Earth Engine: per feature, per feature selecting from
+# a collection shared by the chunk, and image-centric
+#
+# Usage: python benchmark_ee_engines.py [number of features per chunk]
+#
+# Nothing is sent to Earth Engine: the graph built by each engine is recorded by ee_mock and summarized,
+# as well as the graph of the BRDF correction mapped over each image.
+
+import sys
+import ee_mock
+
+ee = ee_mock.install()
+
+import geopandas as gpd
+from shapely.geometry import box
+from ee_tools import get_chunk_collection, get_vi_time_series, get_vi_time_series_by_image, prepare_feature_chunk
+from brdfCorrect import brdf_correct
+
+START_DATE = '1999-01-01'
+END_DATE = '2023-12-31'
+VI_LIST = ['ndvi', 'nirv']
+
+
+def make_synthetic_chunk(num_features):
+    """
+    Creates a chunk of small square polygons along the coast, as the mangrove patches of a chunk.
+    :return: geopandas.GeoDataFrame in EPSG:4326.
+    """
+    polygons = [box(108 + i * 0.01, 21.5, 108 + i * 0.01 + 0.002, 21.502) for i in range(num_features)]
+    return gpd.GeoDataFrame({'patch': list(range(num_features))}, geometry=polygons, crs='EPSG:4326')
+
+
+def build_by_feature(features, ic):
+    return features.map(lambda f: get_vi_time_series(
+        feature=f,
+        image_collection=ic,
+        start_date=START_DATE,
+        end_date=END_DATE,
+        target=VI_LIST
+    )).flatten()
+
+
+def build_by_feature_shared(features, ic):
+    ic_chunk = get_chunk_collection(features, ic, START_DATE, END_DATE, VI_LIST)
+    return features.map(lambda f: get_vi_time_series(
+        feature=f,
+        image_collection=ic_chunk,
+        start_date=START_DATE,
+        end_date=END_DATE,
+        target=VI_LIST,
+        preprocessed=True
+    )).flatten()
+
+
+def build_by_image(features, ic):
+    return get_vi_time_series_by_image(
+        features=features,
+        image_collection=ic,
+        start_date=START_DATE,
+        end_date=END_DATE,
+        target=VI_LIST
+    )
+
+
+if __name__ == "__main__":
+    num_features = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    features, feature_payload = prepare_feature_chunk(make_synthetic_chunk(num_features))
+    ic = ee.ImageCollection('LANDSAT/LE07/C02/T2_L2')
+    print(f">> {num_features} features, {feature_payload / 1024:.1f} KB of feature payload.")
+    print(f"{'engine':>10} {'nodes':>7} {'payload KB':>11} {'client calls':>13} {'reductions':>11} "
+          f"{'preprocessing runs':>19}")
+    for engine, build in (('feature', build_by_feature), ('shared', build_by_feature_shared),
+                          ('image', build_by_image)):
+        ee_mock.reset()
+        result = build(features, ic)
+        client_calls = sum(ee_mock.call_counter.values())
+        stats = ee_mock.get_graph_stats(result)
+        reductions = stats['calls']['reduceRegion'] + stats['calls']['reduceRegions']
+        # filterDate depending on the mapped feature runs once for every feature
+        preprocessing_runs = num_features if stats['dependent_calls']['filterDate'] > 0 else 1
+        print(f"{engine:>10} {stats['nodes']:>7} {stats['payload_bytes'] / 1024:>11.1f} {client_calls:>13} "
+              f"{reductions:>11} {preprocessing_runs:>19}")
+
+    ee_mock.reset()
+    stats = ee_mock.get_graph_stats(brdf_correct(ee.Image('LANDSAT/LE07/C02/T2_L2/SCENE')))
+    print(f">> BRDF correction of one image: {stats['nodes']} nodes, {stats['payload_bytes'] / 1024:.1f} KB, "
+          f"{stats['calls']['expression']} expressions.")
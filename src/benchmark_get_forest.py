@@ -0,0 +1,202 @@
+# Benchmark the hot paths of get_forest on synthetic rasters
+#
+# Usage: python benchmark_get_forest.py [--sizes 1024 4096] [--fractions 0.1 0.4] [--output result.json]
+#                                       [--compare previous.json]
+#
+# Synthetic CLCD-like (Albers, 30 m, class values) and Global-Plantation-like (WGS84, 0.00027 deg, 0/1)
+# GeoTIFFs are generated with a synthetic province mask, and every stage runs in a fresh process so that
+# its peak memory can be measured. Results are stored as JSON to be compared over time.
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import fiona
+import rasterio
+from affine import Affine
+from concurrent.futures import ProcessPoolExecutor
+from shapely.geometry import Polygon, mapping
+from benchmark_resample import get_peak_rss
+from get_forest_tools import (clip_province, create_shapefile, create_shapefile_tiled, degrees_to_meters,
+                              get_resolution, load_clip_features, resample_data)
+
+CLCD_CRS = '+proj=aea +lat_0=0 +lon_0=105 +lat_1=25 +lat_2=47 +x_0=0 +y_0=0 +ellps=krass +units=m +no_defs'
+CLCD_ORIGIN = (1000000, 2600000)
+GP_ORIGIN = (108.0, 22.5)
+GP_RESOLUTION = 0.00027
+# number of calls timed for degrees_to_meters
+DEGREE_CALLS = 200
+
+
+def make_forest_mask(height, width, forest_fraction, seed=0):
+    """
+    Creates a patchy boolean forest mask, by thresholding smoothed noise at the quantile of the forest fraction.
+    :return: (np.ndarray) Boolean mask.
+    """
+    rng = np.random.default_rng(seed)
+    patch = 16
+    coarse = rng.random((height // patch + 2, width // patch + 2)).astype(np.float32)
+    field = np.repeat(np.repeat(coarse, patch, axis=0), patch, axis=1)[:height, :width]
+    field += 0.5 * rng.random((height, width), dtype=np.float32)
+    return field > np.quantile(field[::7, ::7], 1 - forest_fraction)
+
+
+def write_synthetic_rasters(folder, size, forest_fraction):
+    """
+    Writes a CLCD-like and a Global-Plantation-like raster of size x size pixels.
+    :return: (dict) Paths of the rasters by type.
+    """
+    forest = make_forest_mask(size, size, forest_fraction)
+    profile = {'driver': 'GTiff', 'height': size, 'width': size, 'count': 1, 'dtype': 'uint8',
+               'tiled': True, 'blockxsize': 256, 'blockysize': 256}
+    paths = {
+        'CLCD': os.path.join(folder, f"clcd_{size}_{forest_fraction}.tif"),
+        'GP': os.path.join(folder, f"gp_{size}_{forest_fraction}.tif")
+    }
+    # CLCD classes: 1 cropland, 2 forest, 5 water
+    clcd = np.where(forest, 2, 1).astype(np.uint8)
+    clcd[:, -size // 10:] = 5
+    with rasterio.open(paths['CLCD'], 'w', crs=CLCD_CRS,
+                       transform=Affine(30, 0, CLCD_ORIGIN[0], 0, -30, CLCD_ORIGIN[1]), **profile) as dst:
+        dst.write(clcd, 1)
+    with rasterio.open(paths['GP'], 'w', crs='EPSG:4326',
+                       transform=Affine(GP_RESOLUTION, 0, GP_ORIGIN[0], 0, -GP_RESOLUTION, GP_ORIGIN[1]),
+                       **profile) as dst:
+        dst.write(forest.astype(np.uint8), 1)
+    return paths
+
+
+def write_synthetic_province(path_to_raster, path_to_mask, vertices=2000):
+    """
+    Writes a province mask with a wavy, coastline-like outline covering the middle of the raster.
+    """
+    with rasterio.open(path_to_raster) as src:
+        left, bottom, right, top = src.bounds
+        crs = src.crs
+    cx, cy = (left + right) / 2, (bottom + top) / 2
+    radius = 0.4 * min(right - left, top - bottom)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    wobble = 1 + 0.15 * np.sin(7 * angles) + 0.05 * np.sin(61 * angles)
+    outline = Polygon(zip(cx + radius * wobble * np.cos(angles), cy + radius * wobble * np.sin(angles)))
+    schema = {'geometry': 'Polygon', 'properties': {'Province': 'str'}}
+    with fiona.open(path_to_mask, 'w', driver='ESRI Shapefile', crs=crs, schema=schema) as dst:
+        dst.write({'geometry': mapping(outline), 'properties': {'Province': 'Synthetic'}})
+
+
+def run_stage(stage, path_to_raster, raster_type, path_to_mask, folder):
+    """
+    Runs one stage in a worker process.
+    :return: (dict) Wall time in seconds, number of items produced and peak memory increase in MB.
+    """
+    rss_before = get_peak_rss()
+    # the stages report their progress, which is not part of the benchmark
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), \
+            rasterio.open(path_to_raster) as src:
+        lon_m, lat_m = get_resolution(src, raster_type)
+        path_to_export = os.path.join(folder, f"{stage}_{os.path.basename(path_to_raster)}.shp")
+        start = time.perf_counter()
+        if stage == 'degrees_to_meters':
+            for i in range(DEGREE_CALLS):
+                degrees_to_meters(GP_ORIGIN[1] - i * 1e-4, GP_ORIGIN[0], GP_RESOLUTION, GP_RESOLUTION)
+            count = DEGREE_CALLS
+        elif stage == 'resample_data':
+            # 90 m for CLCD is a whole multiple; the GP resolution in meters is not
+            data, _ = resample_data(src, src.read(1), lon_m, lat_m, src.transform, src.crs, target_resolution=90)
+            count = data.size
+        elif stage == 'create_shapefile':
+            count = create_shapefile(src, src.read(1), raster_type, lon_m, lat_m, src.transform, None,
+                                     path_to_export, None, None, 'benchmark')
+        elif stage == 'create_shapefile_tiled':
+            count = create_shapefile_tiled(src, raster_type, path_to_export, None, None, 'benchmark',
+                                           tile_size=1024)
+        elif stage == 'clip':
+            (roi_name, roi_geometry), = load_clip_features(path_to_mask)
+            count = clip_province(src, raster_type, roi_name, roi_geometry, lon_m, lat_m, None,
+                                  path_to_export, None)
+        else:
+            raise ValueError(f"Unknown stage {stage}.")
+        elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'count': count, 'peak_rss_mb': get_peak_rss() - rss_before}
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_results(current, path_to_previous):
+    """
+    Prints the ratio of wall time and peak memory of the current run to a previous one.
+    """
+    with open(path_to_previous) as f:
+        previous = {(r['raster'], r['size'], r['forest_fraction'], r['stage']): r for r in json.load(f)['results']}
+    print(f">> Compared with {path_to_previous} (ratio above 1 is slower / larger):")
+    for r in current:
+        old = previous.get((r['raster'], r['size'], r['forest_fraction'], r['stage']))
+        if old is None:
+            continue
+        time_ratio = r['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        memory_ratio = r['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] else float('nan')
+        print(f"   {r['raster']:>4} {r['size']:>6} {r['forest_fraction']:>5} {r['stage']:>24} "
+              f"time x{time_ratio:.2f}  memory x{memory_ratio:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark get_forest on synthetic rasters.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 4096], help="raster edge in pixels")
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.1, 0.4], help="forest fractions")
+    parser.add_argument('--stages', nargs='+',
+                        default=['degrees_to_meters', 'resample_data', 'create_shapefile',
+                                 'create_shapefile_tiled', 'clip'])
+    parser.add_argument('--output', default=f"benchmark_get_forest_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--compare', default=None, help="previous result to compare with")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            for forest_fraction in args.fractions:
+                paths = write_synthetic_rasters(folder, size, forest_fraction)
+                for raster_type, path_to_raster in paths.items():
+                    path_to_mask = os.path.join(folder, f"province_{raster_type}_{size}.shp")
+                    write_synthetic_province(path_to_raster, path_to_mask)
+                    for stage in args.stages:
+                        with ProcessPoolExecutor(max_workers=1) as pool:
+                            result = pool.submit(run_stage, stage, path_to_raster, raster_type,
+                                                 path_to_mask, folder).result()
+                        result.update({
+                            'raster': raster_type,
+                            'size': size,
+                            'forest_fraction': forest_fraction,
+                            'stage': stage,
+                            'items_per_second': result['count'] / result['seconds'] if result['seconds'] else None
+                        })
+                        results.append(result)
+                        print(f">> {raster_type:>4} {size:>6} px {forest_fraction:>5} forest {stage:>24}: "
+                              f"{result['seconds']:8.3f} s, {result['count']:>10} items, "
+                              f"{result['items_per_second']:12.1f} items/s, {result['peak_rss_mb']:8.1f} MB")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': get_git_commit(),
+            'platform': platform.platform(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'rasterio': rasterio.__version__,
+            'gdal': rasterio.__gdal_version__,
+            'results': results
+        }, f, indent=2)
+    print(f">> Results saved to {args.output}.")
+    if args.compare:
+        compare_results(results, args.compare)
@@ -0,0 +1,81 @@
+# Compare the block max-pool downsampling with reproject() on synthetic rasters
+#
+# Usage: python benchmark_resample.py
+#
+# Every case runs in a fresh process, so the peak memory of one case does not hide another.
+
+import sys
+import time
+import resource
+import numpy as np
+from affine import Affine
+from concurrent.futures import ProcessPoolExecutor
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+from get_forest_tools import block_max_downsample
+
+# (height, width) of the synthetic rasters
+SIZES = [(2000, 2000), (6000, 6000), (12000, 12000)]
+# integer resampling factors, e.g. 30 m to 90 m and to 300 m
+FACTORS = [3, 10]
+# share of forest pixels in the synthetic rasters
+FOREST_FRACTION = 0.2
+
+
+def get_peak_rss():
+    """
+    :return: (float) Peak resident memory of the current process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def make_synthetic_raster(height, width, forest_fraction=FOREST_FRACTION, seed=0):
+    """
+    Creates a CLCD-like array with the forest class (2) scattered over cropland (1).
+    :return: (tuple) Array of uint8 and its transform in a 30 m Albers-like grid.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.empty((height, width), dtype=np.uint8)
+    # fill by rows, so that the random numbers do not dominate the peak memory
+    for i in range(0, height, 256):
+        data[i:i + 256] = np.where(rng.random((min(256, height - i), width)) < forest_fraction, 2, 1)
+    transform = Affine(30, 0, -2000000, 0, -30, 4000000)
+    return data, transform
+
+
+def run_case(method, height, width, factor):
+    """
+    Runs one resampling method on a synthetic raster, in a worker process.
+    :return: (dict) Wall time in seconds and peak memory increase in MB.
+    """
+    data, transform = make_synthetic_raster(height, width)
+    rss_before = get_peak_rss()
+    start = time.perf_counter()
+    if method == 'block_max':
+        block_max_downsample(data, factor, factor, tail='drop')
+    else:
+        destination = np.empty((height // factor, width // factor), dtype=data.dtype)
+        reproject(
+            source=data,
+            destination=destination,
+            src_transform=transform,
+            src_crs='EPSG:3857',
+            dst_transform=transform * Affine.scale(factor, factor),
+            dst_crs='EPSG:3857',
+            resampling=Resampling.max
+        )
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'peak_mb': get_peak_rss() - rss_before}
+
+
+if __name__ == "__main__":
+    print(f"{'size':>13} {'factor':>6} {'method':>10} {'seconds':>9} {'peak MB':>9}")
+    for height, width in SIZES:
+        for factor in FACTORS:
+            for method in ('reproject', 'block_max'):
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run_case, method, height, width, factor).result()
+                print(f"{height:>6}x{width:<6} {factor:>6} {method:>10} "
+                      f"{result['seconds']:>9.3f} {result['peak_mb']:>9.1f}")
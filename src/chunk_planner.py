@@ -0,0 +1,133 @@
+# Plan the chunks of mangrove polygons sent to Earth Engine, balanced by their estimated cost
+#
+# Usage: python chunk_planner.py polygons.shp plan.json [target cost]
+#
+# The cost of a feature is the work of reducing it over every Landsat image: the pixels it covers at 30 m
+# and its vertices, times the number of Landsat scenes it overlaps. Features are packed in spatial order
+# into chunks up to the target cost, so that tasks finish in similar times.
+
+import sys
+import json
+import numpy as np
+import shapely
+import geopandas as gpd
+
+# features per chunk in the fixed chunking, giving the number of chunks for the default target cost
+DEFAULT_CHUNK_FEATURES = 40
+# limits of one chunk, keeping the request and the task within the limits of Earth Engine
+MAX_CHUNK_FEATURES = 400
+MAX_CHUNK_VERTICES = 200000
+# cost of a vertex in pixels, for the geometry tests of each pixel against the polygon edges
+VERTEX_COST = 10
+# WRS-2 scenes of Landsat: footprint width, and spacing of paths (at the equator) and of rows, in km
+SCENE_SIZE_KM = 185
+PATH_SPACING_KM = 172
+ROW_SPACING_KM = 161
+# size of the cells in degrees for the spatial order of features, about one scene
+ORDER_CELL_DEG = 1.5
+# equal-area projection for the area of features
+AREA_CRS = '+proj=cea +datum=WGS84 +units=m +no_defs'
+
+
+def estimate_feature_costs(gdf):
+    """
+    Estimates the cost of each feature.
+    :param gdf: geopandas.GeoDataFrame in EPSG:4326.
+    :return: pandas.DataFrame with columns pixels, vertices, scenes and cost, in the index of gdf.
+    """
+    projected = gdf.geometry.to_crs(AREA_CRS)
+    # pixels inside the polygon, plus the pixels its boundary cuts through
+    pixels = projected.area.to_numpy() / 900 + projected.length.to_numpy() / 30
+    vertices = shapely.get_num_coordinates(gdf.geometry.values)
+    bounds = gdf.geometry.bounds
+    latitude = np.radians((bounds['miny'] + bounds['maxy']).to_numpy() / 2)
+    width_km = (bounds['maxx'] - bounds['minx']).to_numpy() * 111.32 * np.cos(latitude)
+    height_km = (bounds['maxy'] - bounds['miny']).to_numpy() * 110.57
+    # expected number of scene footprints meeting the bounding box, as paths get closer towards the poles
+    scenes = ((width_km + SCENE_SIZE_KM) / (PATH_SPACING_KM * np.cos(latitude))) \
+        * ((height_km + SCENE_SIZE_KM) / ROW_SPACING_KM)
+    return gdf[[]].assign(
+        pixels=pixels,
+        vertices=vertices,
+        scenes=scenes,
+        cost=scenes * (pixels + VERTEX_COST * vertices)
+    )
+
+
+def plan_chunks(gdf, target_cost=None, max_features=MAX_CHUNK_FEATURES, max_vertices=MAX_CHUNK_VERTICES):
+    """
+    Packs the features in spatial order into chunks up to the target cost.
+    :param gdf: geopandas.GeoDataFrame in EPSG:4326.
+    :param (float) target_cost: Cost budget of a chunk, default to the total cost split into as many chunks
+        as chunks of 40 features.
+    :param (int) max_features: Number of features allowed in a chunk.
+    :param (int) max_vertices: Number of vertices allowed in a chunk.
+    :return: (tuple) List of chunks, each a list of index labels of gdf, and the costs from
+        estimate_feature_costs().
+    """
+    costs = estimate_feature_costs(gdf)
+    if target_cost is None:
+        target_cost = costs['cost'].sum() / max(1, int(np.ceil(len(gdf) / DEFAULT_CHUNK_FEATURES)))
+    # neighbouring features share the same scenes, so they go into the same chunks
+    bounds = gdf.geometry.bounds
+    cell_x = np.floor((bounds['minx'] + bounds['maxx']).to_numpy() / 2 / ORDER_CELL_DEG)
+    cell_y = np.floor((bounds['miny'] + bounds['maxy']).to_numpy() / 2 / ORDER_CELL_DEG)
+    order = np.lexsort((cell_y, cell_x))
+
+    chunks = []
+    chunk, chunk_cost, chunk_vertices = [], 0.0, 0
+    for position in order:
+        label = gdf.index[position]
+        cost, vertices = costs['cost'].iat[position], costs['vertices'].iat[position]
+        if chunk and (chunk_cost + cost > target_cost or len(chunk) >= max_features
+                      or chunk_vertices + vertices > max_vertices):
+            chunks.append(chunk)
+            chunk, chunk_cost, chunk_vertices = [], 0.0, 0
+        chunk.append(label)
+        chunk_cost += cost
+        chunk_vertices += vertices
+    if chunk:
+        chunks.append(chunk)
+    oversized = int((costs['cost'] > target_cost).sum())
+    if oversized:
+        print(f"-! {oversized} features cost more than the target alone and are placed in chunks of their own.")
+    return chunks, costs
+
+
+def write_chunk_plan(chunks, costs, path_to_plan):
+    """
+    Writes the plan as JSON, with the features, cost and size of each chunk.
+    :param (list) chunks: Chunks from plan_chunks().
+    :param costs: Costs from plan_chunks().
+    :param (str) path_to_plan: Path to the plan file.
+    """
+    plan = []
+    for chunk_idx, chunk in enumerate(chunks, start=1):
+        chunk_costs = costs.loc[chunk]
+        plan.append({
+            'chunk': chunk_idx,
+            'features': [label.item() if hasattr(label, 'item') else label for label in chunk],
+            'cost': float(chunk_costs['cost'].sum()),
+            'pixels': float(chunk_costs['pixels'].sum()),
+            'vertices': int(chunk_costs['vertices'].sum())
+        })
+    with open(path_to_plan, 'w') as f:
+        json.dump(plan, f, indent=2)
+
+
+def print_chunk_summary(chunks, costs):
+    chunk_costs = np.array([costs.loc[chunk, 'cost'].sum() for chunk in chunks])
+    sizes = np.array([len(chunk) for chunk in chunks])
+    print(f">> {len(chunks)} chunks of {sizes.min()} to {sizes.max()} features, "
+          f"cost from {chunk_costs.min():.3g} to {chunk_costs.max():.3g} (mean {chunk_costs.mean():.3g}).")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("!! Usage: python chunk_planner.py polygons.shp plan.json [target cost]")
+        sys.exit(1)
+    polygons = gpd.read_file(sys.argv[1]).to_crs("epsg:4326")
+    planned_chunks, feature_costs = plan_chunks(polygons, float(sys.argv[3]) if len(sys.argv) == 4 else None)
+    write_chunk_plan(planned_chunks, feature_costs, sys.argv[2])
+    print_chunk_summary(planned_chunks, feature_costs)
+    print(f">> The plan has been saved to {sys.argv[2]}.")
@@ -0,0 +1,238 @@
+# A local stand-in for the Earth Engine API, recording the graph the client builds instead of sending it
+#
+# Usage:
+#     import ee_mock
+#     ee = ee_mock.install()    # before importing ee_tools or other modules using ee
+#     result = ...              # build the computation as usual
+#     get_graph_stats(result)   # size of the graph, count of each call
+#
+# Every call returns a node holding its arguments, and functions given to map() are called once with
+# placeholder arguments, as the real client does. Server-side objects cannot be iterated in Python.
+
+import sys
+import json
+import types
+import inspect
+from collections import Counter
+
+# number of API calls made by the client, by name
+call_counter = Counter()
+
+
+class MockObject:
+    """
+    A node of the computation graph, e.g. ee.Image('...') or image.select('nir').
+    """
+    def __init__(self, name, args=(), kwargs=None):
+        self.name = name
+        self.args = tuple(wrap_argument(a) for a in args)
+        self.kwargs = {k: wrap_argument(v) for k, v in (kwargs or {}).items()}
+        call_counter[name] += 1
+
+    def __getattr__(self, method):
+        if method.startswith('__'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: MockObject(method, (self,) + args, kwargs)
+
+    def __iter__(self):
+        raise TypeError(f"'{self.name}' is a server-side object and cannot be iterated in Python.")
+
+    def __bool__(self):
+        raise TypeError(f"'{self.name}' is a server-side object and has no truth value in Python.")
+
+    def serialize(self):
+        return json.dumps(serialize_graph(self))
+
+
+class MockFunction:
+    """
+    A function given to the API, traced once with a placeholder for each of its arguments.
+    """
+    def __init__(self, func):
+        parameters = [p for p in inspect.signature(func).parameters.values()
+                      if p.default is inspect.Parameter.empty
+                      and p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+        self.name = getattr(func, '__name__', 'function')
+        self.args = tuple(MockObject('argument', (p.name,)) for p in parameters)
+        self.body = wrap_argument(func(*self.args))
+
+
+class MockClass:
+    """
+    A class or namespace of the API, e.g. ee.Image or ee.batch.Export.table. Calling it creates a node,
+    and its attributes are the static methods and nested namespaces.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        return MockClass(f"{self.name}.{attribute}")
+
+    def __call__(self, *args, **kwargs):
+        return MockObject(self.name, args, kwargs)
+
+
+def wrap_argument(value):
+    if callable(value) and not isinstance(value, (MockObject, MockClass, MockFunction)):
+        return MockFunction(value)
+    # containers are copied when called, as the real client encodes them, so later changes do not reach the node
+    if isinstance(value, dict):
+        return {k: wrap_argument(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [wrap_argument(v) for v in value]
+    return value
+
+
+def install():
+    """
+    Replaces the ee module with the mock, for the modules imported afterwards.
+    :return: The mock ee module.
+    """
+    module = types.ModuleType('ee')
+    module.__getattr__ = lambda name: MockClass(name)
+    sys.modules['ee'] = module
+    return module
+
+
+def reset():
+    call_counter.clear()
+
+
+def serialize_graph(node):
+    """
+    Serializes the graph into a table of unique values referenced by their keys, as the real client does.
+    :param node: MockObject of the result.
+    :return: (dict) Values by key and the key of the result.
+    """
+    values = {}
+    keys = {}
+
+    def encode(value):
+        if isinstance(value, (MockObject, MockFunction)):
+            if id(value) not in keys:
+                keys[id(value)] = str(len(keys))
+                if isinstance(value, MockFunction):
+                    encoded = {'functionDefinitionValue': {
+                        'argumentNames': [a.args[0] for a in value.args], 'body': encode(value.body)}}
+                else:
+                    encoded = {'functionInvocationValue': {
+                        'functionName': value.name,
+                        'arguments': [encode(a) for a in value.args],
+                        'keywords': {k: encode(v) for k, v in value.kwargs.items()}}}
+                values[keys[id(value)]] = encoded
+            return {'valueReference': keys[id(value)]}
+        if isinstance(value, (list, tuple)):
+            return {'arrayValue': [encode(v) for v in value]}
+        if isinstance(value, dict):
+            return {'dictionaryValue': {str(k): encode(v) for k, v in value.items()}}
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return {'constantValue': value}
+        return {'constantValue': repr(value)}
+
+    result = encode(node)
+    return {'values': values, 'result': result}
+
+
+def get_graph_stats(node):
+    """
+    Summarizes the graph of a result.
+    :param node: MockObject of the result.
+    :return: (dict) Number of unique nodes, size of the serialized graph in bytes, count of each call in the
+        graph, the depth of map() nesting at which each call first appears, and the count of each call
+        depending on the argument of a mapped function. A call nested in map() but not depending on its
+        argument is the same for every element, and is computed once; a call depending on it runs for every
+        element of the mapped collection.
+    """
+    calls = Counter()
+    depth_of_call = {}
+    seen = set()
+
+    def visit(value, depth):
+        if isinstance(value, MockFunction):
+            # the body of a mapped function runs once per element of the collection
+            visit(value.body, depth + 1)
+        elif isinstance(value, MockObject):
+            if id(value) in seen:
+                return
+            seen.add(id(value))
+            calls[value.name] += 1
+            depth_of_call[value.name] = min(depth_of_call.get(value.name, depth), depth)
+            for a in value.args:
+                visit(a, depth)
+            for v in value.kwargs.values():
+                visit(v, depth)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                visit(v, depth)
+        elif isinstance(value, dict):
+            for v in value.values():
+                visit(v, depth)
+
+    visit(node, 0)
+    dependent_calls = Counter(value.name for value in get_dependent_nodes(node))
+    return {
+        'nodes': len(seen),
+        'payload_bytes': len(node.serialize().encode('utf-8')),
+        'calls': calls,
+        'depth_of_call': depth_of_call,
+        'dependent_calls': dependent_calls
+    }
+
+
+def get_dependent_nodes(node):
+    """
+    Finds the nodes depending on the argument of a mapped function, without recursion as graphs get deep.
+    The body of a nested function is compiled once, so its own arguments do not make the caller vary.
+    :return: (list) MockObject nodes.
+    """
+    def children(value):
+        found, stack = [], list(value.args) + list(value.kwargs.values())
+        while stack:
+            item = stack.pop()
+            if isinstance(item, MockObject):
+                found.append(item)
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+            elif isinstance(item, dict):
+                stack.extend(item.values())
+        return found
+
+    nodes = get_graph_nodes(node)
+    depends = {}
+    visited = set()
+    for value in nodes:
+        stack = [(value, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if expanded:
+                # the children were all resolved, as they were pushed after the item
+                depends[id(item)] = item.name == 'argument' or any(depends[id(c)] for c in children(item))
+            elif id(item) not in visited:
+                visited.add(id(item))
+                stack.append((item, True))
+                stack.extend((c, False) for c in children(item) if id(c) not in visited)
+    return [value for value in nodes if depends[id(value)]]
+
+
+def get_graph_nodes(node):
+    """
+    :return: (list) Unique MockObject nodes of the graph, including the bodies of mapped functions.
+    """
+    nodes = {}
+    stack = [node]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, MockFunction):
+            stack.append(value.body)
+        elif isinstance(value, MockObject):
+            if id(value) not in nodes:
+                nodes[id(value)] = value
+                stack.extend(value.args)
+                stack.extend(value.kwargs.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+    return list(nodes.values())
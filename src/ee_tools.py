@@ -1,4 +1,5 @@
 import ee
+import json
 from brdfCorrect import brdf_correct
 
 
@@ -24,24 +25,9 @@ def apply_scaling_offset(image):
     :return: ee.Image
     """
     bands_to_modify = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
-    scale = ee.Number(2.75e-05)
-    offset = ee.Number(-0.2)
-
-    def scale_band(band_name):
-        band = image.select(band_name)
-        return band.multiply(scale).add(offset).rename(band_name)
-
-    # scale and offset each specified band
-    scaled_bands = [scale_band(band_name) for band_name in bands_to_modify]
-    scaled_image = ee.ImageCollection(scaled_bands).toBands()
-    original_names = ee.List(bands_to_modify)
-    renamed_scaled_image = scaled_image.rename(original_names)
-
-    # combine scaled bands with the original bands
-    modified_image = image.select(image.bandNames().removeAll(bands_to_modify)) \
-        .addBands(renamed_scaled_image)
-
-    return modified_image
+    # one multiply and add over the bands, replacing them in place
+    scaled_bands = image.select(bands_to_modify).multiply(2.75e-05).add(-0.2)
+    return image.addBands(scaled_bands, None, True)
 
 
 def get_ndvi(image):
@@ -72,51 +58,169 @@ def get_nirv(image):
     return image.addBands(nirv)
 
 
-def get_vi_time_series(feature, image_collection, start_date, end_date, target='ndvi'):
+# functions adding each vegetation index as a band
+VI_FUNCTIONS = {
+    'ndvi': get_ndvi,
+    'nirv': get_nirv
+}
+
+
+def get_vi_time_series(feature, image_collection, start_date, end_date, target='ndvi', preprocessed=False):
     """
     Calculate the time series of mean pixel-based vegetation index over the given feature,
     using the longitude and latitude of the feature centroid to mark the location.
+    All indices are reduced together in one reduceRegion per image.
     :param feature: ee.Feature, the region of interest.
     :param image_collection: ee.ImageCollection, the image collection to map over.
     :param start_date: string, the start date of image, in format 'YYYY-MM-dd'.
     :param end_date: string, the end date of image, in format 'YYYY-MM-dd'.
-    :param target: string, ndvi or nirv, default to ndvi.
-    :return: ee.FeatureCollection, containing centroid location and VI values in each feature.
+    :param target: string or list of strings, ndvi and/or nirv, default to ndvi.
+    :param preprocessed: bool, whether image_collection comes from get_chunk_collection(), shared by the
+        features of a chunk, so that only the images over the feature are selected from it.
+    :return: ee.FeatureCollection, containing centroid location and VI values in each feature, in column target
+        for one index, or in one column per index for a list.
     """
+    targets = [target] if isinstance(target, str) else list(target)
+    geometry = feature.geometry()
     # get centroid location of the given feature
-    centroid = feature.geometry().centroid()
+    centroid = geometry.centroid()
     lon = centroid.coordinates().get(0)
     lat = centroid.coordinates().get(1)
-    # filter images by date and location, and apply pre-process on images
-    ic_filtered = image_collection \
-        .filterBounds(feature.geometry()) \
-        .filterDate(start_date, end_date) \
-        .map(mask_landsat7_sr) \
-        .map(apply_scaling_offset) \
-        .map(brdf_correct) \
-        .map(get_ndvi) \
-        .map(get_nirv)
-
-    def calc_mean_vi(image, vi):
-        return ee.Image(image).reduceRegion(
+    if preprocessed:
+        ic_filtered = image_collection.filterBounds(geometry)
+    else:
+        ic_filtered = preprocess_collection(image_collection, geometry, start_date, end_date, targets)
+
+    def calc_mean_vi(image):
+        # one pass over the pixels of the feature for all indices
+        means = ee.Image(image).select(targets).reduceRegion(
             reducer=ee.Reducer.mean(),
-            geometry=feature.geometry(),
+            geometry=geometry,
             scale=30,
             maxPixels=1e9
-        ).get(vi)
-
-    def convert_list_to_feature(element):
-        return ee.Feature(None, {
+        )
+        properties = {'target': means.get(target)} if isinstance(target, str) else means
+        return ee.Feature(None, properties).set({
             'lon': lon,
             'lat': lat,
-            'prop': element
+            'system:index': image.get('system:index')
+        })
+
+    return ee.FeatureCollection(ic_filtered.map(calc_mean_vi))
+
+
+def get_vi_time_series_by_image(features, image_collection, start_date, end_date, target='ndvi'):
+    """
+    Calculate the same time series as get_vi_time_series() mapped over the features and flattened, but centred
+    on images: the collection is filtered and preprocessed once for all features, and each image is reduced
+    over the features it touches with one reduceRegions.
+    :param features: ee.FeatureCollection, the regions of interest.
+    :param image_collection: ee.ImageCollection, the image collection to map over.
+    :param start_date: string, the start date of image, in format 'YYYY-MM-dd'.
+    :param end_date: string, the end date of image, in format 'YYYY-MM-dd'.
+    :param target: string or list of strings, ndvi and/or nirv, default to ndvi.
+    :return: ee.FeatureCollection, one row per feature and image, with system:index as
+        {feature index}_{image index}, centroid location and VI values as in get_vi_time_series().
+    """
+    targets = [target] if isinstance(target, str) else list(target)
+    value_columns = ['target'] if isinstance(target, str) else targets
+
+    def add_location(feature):
+        centroid = feature.geometry().centroid().coordinates()
+        return ee.Feature(feature.geometry(), {
+            'lon': centroid.get(0),
+            'lat': centroid.get(1),
+            'featureIndex': feature.get('system:index')
         })
 
-    # create a list of image and extract mean NDVI values from each image
-    image_list = ic_filtered.toList(ic_filtered.select(target).size())
-    vi_list = [calc_mean_vi(img, target) for img in image_list]
-    id_list = ic_filtered.aggregate_array('system:index')
-    # join all lists
-    values = id_list.zip(vi_list)
+    # the centroid of each feature is calculated once, not once per image
+    located = features.map(add_location)
+    ic_filtered = get_chunk_collection(located, image_collection, start_date, end_date, target)
+    # a single band would be reduced into property mean, so name the outputs after the bands
+    reducer = ee.Reducer.mean().setOutputs(targets) if len(targets) == 1 else ee.Reducer.mean()
+
+    def reduce_image(image):
+        image = ee.Image(image)
+        image_index = ee.String(image.get('system:index'))
+        reduced = image.select(targets).reduceRegions(
+            collection=located.filterBounds(image.geometry()),
+            reducer=reducer,
+            scale=30
+        )
+
+        def to_row(feature):
+            values = dict(zip(value_columns, [feature.get(vi) for vi in targets]))
+            return ee.Feature(None, {
+                **values,
+                'lon': feature.get('lon'),
+                'lat': feature.get('lat'),
+                'rowIndex': ee.String(feature.get('featureIndex')).cat('_').cat(image_index)
+            })
+
+        return reduced.map(to_row)
+
+    def set_row_index(row):
+        # flatten() prefixes the index of each row, so it is set here once the rows are collected
+        return ee.Feature(None, {column: row.get(column) for column in value_columns + ['lon', 'lat']}) \
+            .set('system:index', row.get('rowIndex'))
+
+    return ic_filtered.map(reduce_image).flatten().map(set_row_index)
+
+
+def preprocess_collection(image_collection, region, start_date, end_date, targets):
+    """
+    Filters images by date and location, masks clouds, scales the bands, corrects BRDF and adds the
+    requested vegetation indices.
+    :param image_collection: ee.ImageCollection, the image collection to map over.
+    :param region: ee.Geometry, the area to cover.
+    :param start_date: string, the start date of image, in format 'YYYY-MM-dd'.
+    :param end_date: string, the end date of image, in format 'YYYY-MM-dd'.
+    :param targets: list of strings, the indices to add, see VI_FUNCTIONS.
+    :return: ee.ImageCollection
+    """
+    ic_filtered = image_collection \
+        .filterBounds(region) \
+        .filterDate(start_date, end_date) \
+        .map(mask_landsat7_sr) \
+        .map(apply_scaling_offset) \
+        .map(brdf_correct)
+    # add the requested indices only
+    for vi in targets:
+        ic_filtered = ic_filtered.map(VI_FUNCTIONS[vi])
+    return ic_filtered
+
+
+def get_chunk_collection(features, image_collection, start_date, end_date, target='ndvi'):
+    """
+    Preprocesses the collection once for all features of a chunk, over the bounds of the chunk.
+    :param features: ee.FeatureCollection, the regions of interest.
+    :param image_collection: ee.ImageCollection, the image collection to map over.
+    :param start_date: string, the start date of image, in format 'YYYY-MM-dd'.
+    :param end_date: string, the end date of image, in format 'YYYY-MM-dd'.
+    :param target: string or list of strings, ndvi and/or nirv, default to ndvi.
+    :return: ee.ImageCollection, see preprocess_collection().
+    """
+    targets = [target] if isinstance(target, str) else list(target)
+    return preprocess_collection(image_collection, features.geometry().bounds(), start_date, end_date, targets)
+
 
-    return ee.FeatureCollection([convert_list_to_feature(ele) for ele in values])
+def prepare_feature_chunk(gdf):
+    """
+    Serializes a slice of the geo-dataframe once and builds its Earth Engine feature collection,
+    to be reused by every vegetation index calculated over the chunk.
+    Polygons are stored as multi-polygons, so that all features share the same geometry type.
+    :param gdf: geopandas.GeoDataFrame in EPSG:4326.
+    :return: (tuple) ee.FeatureCollection, and the size in bytes of its serialized request payload.
+    """
+    ee_features = []
+    for feature in json.loads(gdf.to_json())['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            coordinates = geometry['coordinates']
+        else:
+            raise ValueError(f"Unsupported geometry type {geometry['type']} in feature {feature.get('id')}.")
+        ee_features.append(ee.Feature(ee.Geometry.MultiPolygon(coordinates), feature['properties']))
+    feature_collection = ee.FeatureCollection(ee_features)
+    return feature_collection, len(feature_collection.serialize().encode('utf-8'))
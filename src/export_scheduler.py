@@ -0,0 +1,203 @@
+# Run export tasks of Earth Engine concurrently, keeping a number of tasks in flight
+#
+# Usage:
+#     jobs = [{'name': 'Mean_ndvi-nirv_1', 'make_task': lambda: ee.batch.Export.table.toDrive(...)}, ...]
+#     states = run_export_jobs(jobs, EarthEngineBackend(), max_in_flight=10)
+#
+# A new task starts as soon as another one finishes, the state of running tasks is polled with backoff,
+# and failed or rate-limited tasks are retried. The backend only has to start a job and report the state
+# of its task, so the scheduler can be tried against FakeTaskService without Earth Engine:
+#     python export_scheduler.py
+
+import sys
+import time
+import random
+import asyncio
+import threading
+
+# final states of a task
+COMPLETED_STATES = ('COMPLETED',)
+# UNKNOWN for a task ID the service does not know, e.g. from an earlier run long ago
+FAILED_STATES = ('FAILED', 'CANCELLED', 'UNKNOWN')
+
+
+class RateLimitError(Exception):
+    """
+    Raised by a backend when the task service refuses new tasks for now.
+    """
+
+
+class EarthEngineBackend:
+    """
+    Starts the tasks on Earth Engine. Each job gives a function creating its (unstarted) export task.
+    """
+    # words in the errors of Earth Engine when too many tasks are queued or the request rate is exceeded
+    RATE_LIMIT_WORDS = ('too many', 'quota', 'rate limit')
+
+    def __init__(self):
+        self.tasks = {}
+
+    def start(self, job):
+        import ee
+        task = job['make_task']()
+        try:
+            task.start()
+        except ee.EEException as e:
+            if any(word in str(e).lower() for word in self.RATE_LIMIT_WORDS):
+                raise RateLimitError(str(e)) from e
+            raise
+        self.tasks[task.id] = task
+        return task.id
+
+    def get_state(self, task_id):
+        if task_id in self.tasks:
+            status = self.tasks[task_id].status()
+        else:
+            # a task started by an earlier run
+            import ee
+            status = ee.data.getTaskStatus(task_id)[0]
+        return status['state'], status.get('error_message')
+
+
+class FakeTaskService:
+    """
+    A local task service for trying the scheduler: tasks take a random duration, some of them fail,
+    and new tasks are refused while quota tasks are running.
+    """
+    def __init__(self, duration=(1.0, 3.0), failure_rate=0.05, quota=10, seed=0):
+        self.duration = duration
+        self.failure_rate = failure_rate
+        self.quota = quota
+        self.random = random.Random(seed)
+        self.tasks = {}
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def start(self, job):
+        with self.lock:
+            now = time.monotonic()
+            if sum(1 for task in self.tasks.values() if task['end'] > now) >= self.quota:
+                self.refused += 1
+                raise RateLimitError(f"Too many tasks running ({self.quota}).")
+            task_id = f"FAKE_{len(self.tasks)}"
+            self.tasks[task_id] = {
+                'end': now + self.random.uniform(*self.duration),
+                'fails': self.random.random() < self.failure_rate
+            }
+        return task_id
+
+    def get_state(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return 'UNKNOWN', f"Task {task_id} not found."
+        if time.monotonic() < task['end']:
+            return 'RUNNING', None
+        return ('FAILED', "Fake failure.") if task['fails'] else ('COMPLETED', None)
+
+
+def run_export_jobs(jobs, backend, max_in_flight=10, poll_interval=5.0, max_poll_interval=60.0, max_retries=3,
+                    on_state=None):
+    """
+    Runs the jobs with at most max_in_flight tasks at a time, until each of them completes or runs out of retries.
+    :param (list) jobs: Jobs as dictionaries with a unique 'name', and what the backend needs to start them.
+        A job with a 'task_id' from an earlier run waits for that task first, and starts a new one only if
+        it did not complete.
+    :param backend: Object with start(job) returning a task ID, and get_state(task_id) returning the state
+        and the error message of the task, e.g. EarthEngineBackend or FakeTaskService.
+    :param (int) max_in_flight: Number of tasks running at the same time.
+    :param (float) poll_interval: First delay in seconds between two polls of a task, and between two attempts
+        to start a rate-limited task. The delay grows with every poll up to max_poll_interval.
+    :param (float) max_poll_interval: Longest delay in seconds between two polls.
+    :param (int) max_retries: Number of times a failed task is started again.
+    :param on_state: Function called with the job, its state (SUBMITTED, COMPLETED, FAILED or CANCELLED)
+        and its task ID whenever a task starts or ends, None to skip.
+    :return: (dict) Final state of each job by name.
+    """
+    async def run_all():
+        slots = asyncio.Semaphore(max_in_flight)
+        states = await asyncio.gather(*(
+            run_export_job(job, backend, slots, poll_interval, max_poll_interval, max_retries, on_state)
+            for job in jobs
+        ))
+        return dict(zip((job['name'] for job in jobs), states))
+
+    return asyncio.run(run_all())
+
+
+async def run_export_job(job, backend, slots, poll_interval, max_poll_interval, max_retries, on_state):
+    """
+    Runs one job in a free slot, starting its task again when it fails.
+    :return: (str) Final state of the job.
+    """
+    async with slots:
+        if job.get('task_id'):
+            state, error = await wait_for_task(job['task_id'], backend, poll_interval, max_poll_interval)
+            notify(on_state, job, state, job['task_id'])
+            if state in COMPLETED_STATES:
+                return state
+            print(f"-! Earlier task of {job['name']} ended as {state}: {error} (starting again).")
+        for attempt in range(max_retries + 1):
+            try:
+                task_id = await start_task(job, backend, poll_interval, max_poll_interval)
+            except Exception as e:
+                state, error, task_id = 'FAILED', str(e), None
+            else:
+                notify(on_state, job, 'SUBMITTED', task_id)
+                state, error = await wait_for_task(task_id, backend, poll_interval, max_poll_interval)
+            notify(on_state, job, state, task_id)
+            if state in COMPLETED_STATES:
+                return state
+            retry = "retrying" if attempt < max_retries else "giving up"
+            print(f"-! Task {job['name']} ended as {state}: {error} ({retry}).")
+        return state
+
+
+async def start_task(job, backend, poll_interval, max_poll_interval):
+    """
+    Starts the task of a job, waiting with backoff while the service refuses new tasks.
+    :return: (str) Task ID.
+    """
+    delay = poll_interval
+    while True:
+        try:
+            return await asyncio.to_thread(backend.start, job)
+        except RateLimitError:
+            # jitter keeps the waiting jobs from all coming back at the same moment
+            await asyncio.sleep(delay * random.uniform(1, 1.5))
+            delay = min(delay * 2, max_poll_interval)
+
+
+async def wait_for_task(task_id, backend, poll_interval, max_poll_interval):
+    """
+    Polls the state of a task with a growing delay until it ends.
+    :return: (tuple) Final state and error message.
+    """
+    delay = poll_interval
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            state, error = await asyncio.to_thread(backend.get_state, task_id)
+        except Exception as e:
+            print(f"-! Failed to check task {task_id}: {e}.")
+        else:
+            if state in COMPLETED_STATES or state in FAILED_STATES:
+                return state, error
+        delay = min(delay * 1.5, max_poll_interval)
+
+
+def notify(on_state, job, state, task_id):
+    if on_state is not None:
+        on_state(job, state, task_id)
+
+
+if __name__ == "__main__":
+    # try the scheduler on fake tasks: the run should take about jobs x mean duration / quota
+    num_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    service = FakeTaskService(duration=(0.2, 0.6), failure_rate=0.05, quota=20)
+    start = time.perf_counter()
+    final_states = run_export_jobs([{'name': f"job_{i}"} for i in range(num_jobs)], service,
+                                   max_in_flight=20, poll_interval=0.05, max_poll_interval=0.5)
+    elapsed = time.perf_counter() - start
+    completed = sum(state in COMPLETED_STATES for state in final_states.values())
+    print(f">> {completed} of {num_jobs} jobs completed in {elapsed:.1f} seconds, with {len(service.tasks)} tasks "
+          f"started and {service.refused} refused by the quota (ideal: {num_jobs * 0.4 / 20:.1f} seconds).")
@@ -0,0 +1,100 @@
+# Keep track of the exports of MangroveStability.py, so that a run can be restarted at no cost
+#
+# The manifest is a JSON file with one entry per export, named after its content:
+# {
+#     "Mean_ndvi-nirv_0001-1a2b3c4d5e": {
+#         "chunk": 1,
+#         "features": [0, 1, 2, ...],   (index labels of the features in the chunk)
+#         "vi": ["ndvi", "nirv"],
+#         "task_id": "...",             (task of the latest attempt, null before the first one)
+#         "state": "COMPLETED",         (PENDING, SUBMITTED, COMPLETED, FAILED, CANCELLED or UNKNOWN)
+#         "output": "Mangrove/Mean_ndvi-nirv_0001-1a2b3c4d5e.csv",
+#         "updated": "2024-05-01T12:00:00"
+#     }
+# }
+# The manifest is saved after every change of state, so completed exports are skipped after a restart,
+# and tasks still running from the interrupted run are waited for instead of being started again.
+
+import os
+import json
+import time
+import hashlib
+
+
+def get_export_name(chunk_idx, feature_ids, vi_list, settings):
+    """
+    Names an export after its content, so that the same chunk gets the same name in every run, and a chunk
+    with other features or settings gets another name.
+    :param (int) chunk_idx: Number of the chunk, kept in the name for reading.
+    :param (list) feature_ids: Index labels of the features in the chunk.
+    :param (list) vi_list: Vegetation indices of the export.
+    :param (dict) settings: Other settings changing the result, e.g. the dates and the engine.
+    :return: (str) Name in the format Mean_{indices}_{chunk}-{digest}, read by arrange_ee_tables.py.
+    """
+    content = json.dumps({'features': list(feature_ids), 'vi': list(vi_list), **settings}, sort_keys=True,
+                         default=str)
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:10]
+    return f"Mean_{'-'.join(vi_list)}_{chunk_idx:04d}-{digest}"
+
+
+def load_run_manifest(path_to_manifest):
+    """
+    :param (str) path_to_manifest: Path to the manifest in JSON.
+    :return: (dict) Entries by export name, empty for a new run.
+    """
+    if not os.path.exists(path_to_manifest):
+        return {}
+    with open(path_to_manifest) as f:
+        return json.load(f)
+
+
+def save_run_manifest(manifest, path_to_manifest):
+    # write to a temporary file first, so that an interruption never leaves a broken manifest
+    temporary_path = f"{path_to_manifest}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, path_to_manifest)
+
+
+def register_export(manifest, name, chunk_idx, feature_ids, vi_list, output):
+    """
+    Adds an export to the manifest, keeping the entry of an earlier run.
+    :return: (dict) The entry of the export.
+    """
+    return manifest.setdefault(name, {
+        'chunk': chunk_idx,
+        'features': [feature_id.item() if hasattr(feature_id, 'item') else feature_id for feature_id in feature_ids],
+        'vi': list(vi_list),
+        'task_id': None,
+        'state': 'PENDING',
+        'output': output,
+        'updated': time.strftime('%Y-%m-%dT%H:%M:%S')
+    })
+
+
+def is_export_completed(manifest, name):
+    return manifest.get(name, {}).get('state') == 'COMPLETED'
+
+
+def get_resumable_task(manifest, name):
+    """
+    :return: (str) ID of the task still running from an earlier run, None if there is none.
+    """
+    entry = manifest.get(name, {})
+    return entry.get('task_id') if entry.get('state') == 'SUBMITTED' else None
+
+
+def get_manifest_updater(manifest, path_to_manifest):
+    """
+    Makes the on_state callback of run_export_jobs(), recording every change of state in the manifest.
+    :return: Function taking the job, its state and its task ID.
+    """
+    def on_state(job, state, task_id):
+        entry = manifest[job['name']]
+        entry['state'] = state
+        if task_id is not None:
+            entry['task_id'] = task_id
+        entry['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        save_run_manifest(manifest, path_to_manifest)
+
+    return on_state
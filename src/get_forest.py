@@ -1,75 +1,118 @@
 # Create shapefile from raster based on band values
 
 import rasterio
-from rasterio.mask import mask
-from shapely.geometry import box
 from get_forest_tools import *
 
-path_to_tif = input("-- Path to the raster file: ")
+# the guard keeps worker processes of the parallel mode from re-running the prompts
+if __name__ == "__main__":
+    path_to_tif = input("-- Path to the raster file: ")
 
-# A divert-er for image process
-tif_type = get_raster_type()
+    # A divert-er for image process
+    tif_type = get_raster_type()
+    # Several classes can be polygonized in one pass instead of the forest class only
+    classes, split_classes = get_class_info()
+    criteria = ask_selection_criteria() if tif_type not in ("CLCD", "GP") and classes is None else None
 
-# Main process
-try:
-    with rasterio.open(path_to_tif) as src:
-        # load the raster data
-        print(">> Reading raster...")
-        tif, lon_res, lat_res, target_resolution = get_resample_info(src, tif_type)
+    # Tiled mode reads the raster by windows instead of loading it at once
+    tile_size = whether_to_tile()
 
-        # Local masks
-        path_to_mask, path_to_export, prefix_for_export = whether_to_clip()
+    # Main process
+    try:
+        with rasterio.open(path_to_tif) as src:
+            # load the raster data
+            print(">> Reading raster...")
+            _, lon_res, lat_res, target_resolution = get_resample_info(src, tif_type, read_data=False)
 
-        # Process the raster
-        if path_to_mask is None:
-            # --> process the whole raster directly
-            create_shapefile(
-                src=src,
-                data=tif,
-                data_type=tif_type,
-                longitude_in_meter=lon_res,
-                latitude_in_meter=lat_res,
-                transform=src.transform,
-                target_resolution=target_resolution,
-                path_to_export=path_to_export,
-                prefix_to_export=None,
-                roi=None,
-                file_name=None
-            )
-        else:
-            # --> clip before processing the data
-            with fiona.open(path_to_mask, 'r') as roi:
-                for province in roi:
-                    roi_name = province['properties']['Province']
-                    roi_geometry = shape(province['geometry'])
-                    print(f">> Now clipping area of {roi_name}.")
-                    # get the minimum bounding rectangle of the roi geometry
-                    minx, miny, maxx, maxy = roi_geometry.bounds
-                    bbox = box(minx, miny, maxx, maxy)
-                    # clip the raster with the roi geometry
-                    try:
-                        clipped_image, clipped_transform = mask(src, [mapping(bbox)], crop=True)
-                    except ValueError as e:
-                        continue
-                    # convert pixels and create shapefile
+            # Local masks
+            path_to_mask, path_to_export, prefix_for_export = whether_to_clip()
+            if path_to_mask is not None:
+                export_format = get_export_format()
+                num_workers, memory_per_worker = get_parallel_info()
+            else:
+                export_format = None
+                num_workers, memory_per_worker = None, None
+
+            # Process the raster
+            if path_to_mask is None:
+                if tile_size is not None:
+                    # --> polygonize the whole raster window by window
+                    create_shapefile_tiled(
+                        src=src,
+                        data_type=tif_type,
+                        path_to_export=path_to_export,
+                        prefix_to_export=None,
+                        roi=None,
+                        file_name=None,
+                        tile_size=tile_size,
+                        criteria=criteria,
+                        classes=classes,
+                        split_classes=split_classes,
+                        longitude_in_meter=lon_res,
+                        latitude_in_meter=lat_res,
+                        target_resolution=target_resolution
+                    )
+                else:
+                    # --> process the whole raster directly
                     create_shapefile(
                         src=src,
-                        data=clipped_image[0],  # first band only
+                        data=src.read(1),
                         data_type=tif_type,
                         longitude_in_meter=lon_res,
                         latitude_in_meter=lat_res,
-                        transform=clipped_transform,
+                        transform=src.transform,
                         target_resolution=target_resolution,
                         path_to_export=path_to_export,
-                        prefix_to_export=prefix_for_export,
-                        roi=roi_geometry,
-                        file_name=roi_name
+                        prefix_to_export=None,
+                        roi=None,
+                        file_name=None,
+                        criteria=criteria,
+                        classes=classes,
+                        split_classes=split_classes
                     )
-    print(">> The polygons have been saved to the destination.")
+            elif num_workers is not None:
+                # --> clip every area in its own worker process
+                clip_provinces_in_parallel(
+                    path_to_tif=path_to_tif,
+                    path_to_mask=path_to_mask,
+                    data_type=tif_type,
+                    longitude_in_meter=lon_res,
+                    latitude_in_meter=lat_res,
+                    target_resolution=target_resolution,
+                    path_to_export=path_to_export,
+                    prefix_to_export=prefix_for_export,
+                    tile_size=tile_size,
+                    criteria=criteria,
+                    export_format=export_format,
+                    num_workers=num_workers,
+                    memory_per_worker=memory_per_worker,
+                    classes=classes,
+                    split_classes=split_classes
+                )
+            else:
+                # --> clip before processing the data
+                with fiona.open(path_to_mask, 'r') as roi:
+                    for province in roi:
+                        clip_province(
+                            src=src,
+                            data_type=tif_type,
+                            roi_name=province['properties']['Province'],
+                            roi_geometry=shape(province['geometry']),
+                            longitude_in_meter=lon_res,
+                            latitude_in_meter=lat_res,
+                            target_resolution=target_resolution,
+                            path_to_export=path_to_export,
+                            prefix_to_export=prefix_for_export,
+                            tile_size=tile_size,
+                            criteria=criteria,
+                            export_format=export_format,
+                            classes=classes,
+                            split_classes=split_classes
+                        )
+        print(">> The polygons have been saved to the destination.")
 
-except rasterio.errors.RasterioIOError as e:
-    print(f"RasterioIOError: {e}. Please check the raster path and format.")
-except UnicodeDecodeError as e:
-    print(f"UnicodeDecodeError: {e}. This may indicate an issue with the raster encoding.")
-except Exception as e:
-    print(f"An unexpected error occurred: {e}.")
+    except rasterio.errors.RasterioIOError as e:
+        print(f"RasterioIOError: {e}. Please check the raster path and format.")
+    except UnicodeDecodeError as e:
+        print(f"UnicodeDecodeError: {e}. This may indicate an issue with the raster encoding.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}.")
@@ -0,0 +1,211 @@
+# Create shapefiles from many rasters without prompts, following a manifest
+#
+# Usage: python get_forest_batch.py manifest.json
+#
+# The manifest is a JSON file such as:
+# {
+#     "num_workers": 8,                  (optional, default to the number of CPUs)
+#     "memory_per_worker": 4000,         (optional, in MB)
+#     "rasters": [
+#         {
+#             "path": "/data/CLCD_v01_2000.tif",
+#             "type": "CLCD",            (CLCD, GP or others)
+#             "criteria": null,          (for others: ["value", 2] or ["range", 2, 4])
+#             "classes": null,           (several classes in one combined layer with their band values,
+#                                         e.g. [["value", 2], ["range", 3, 4]], replacing type and criteria)
+#             "target_resolution": null, (in meters, null for no resampling)
+#             "tile_size": null,         (in pixels, null to read the raster at once)
+#             "clip_mask": "/data/provinces.shp",
+#             "export": "/output/clcd",  (folder if clip_mask is given, otherwise the export file)
+#             "prefix": "CLCD_2000",     (with clip_mask only, output format: prefix_province.format)
+#             "format": "gpkg"           (with clip_mask only, shp, gpkg or fgb)
+#         }
+#     ]
+# }
+# Outputs are first written under a temporary name, so outputs that already exist are complete
+# and are skipped when the manifest is run again.
+
+import os
+import sys
+import glob
+import json
+import rasterio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from get_forest_tools import (create_shapefile, create_shapefile_tiled, clip_province, get_export_path,
+                              get_resolution, get_worker_count, limit_worker_memory, load_clip_features,
+                              get_value_type, open_batch_writer)
+
+# clip features of every mask in the manifest, loaded once into each worker
+_clip_features = {}
+
+
+def load_manifest(path_to_manifest):
+    """
+    Loads the manifest and expands it into one job per output file.
+    :param (str) path_to_manifest: Path to the manifest in JSON.
+    :return: (tuple) List of jobs, clip features by mask path, and the pool settings of the manifest.
+    """
+    with open(path_to_manifest) as f:
+        manifest = json.load(f)
+    clip_features = {}
+    jobs = []
+    for raster in manifest['rasters']:
+        criteria = tuple(raster['criteria']) if raster.get('criteria') else None
+        classes = [tuple(c) for c in raster['classes']] if raster.get('classes') else None
+        if raster['type'] not in ("CLCD", "GP") and criteria is None and classes is None:
+            raise ValueError(f"Criteria is required for raster {raster['path']} of type {raster['type']}.")
+        job = {
+            'raster': raster['path'],
+            'type': raster['type'],
+            'criteria': criteria,
+            'classes': classes,
+            'target_resolution': raster.get('target_resolution'),
+            'tile_size': raster.get('tile_size'),
+            'mask': raster.get('clip_mask'),
+            'roi_name': None,
+            'output': raster['export']
+        }
+        if job['mask'] is None:
+            jobs.append(job)
+            continue
+        # each mask is read once and shared by all rasters clipped with it
+        if job['mask'] not in clip_features:
+            clip_features[job['mask']] = dict(load_clip_features(job['mask']))
+        for roi_name in clip_features[job['mask']]:
+            jobs.append({
+                **job,
+                'roi_name': roi_name,
+                'output': get_export_path(raster['export'], raster['prefix'], roi_name, raster.get('format', 'shp'))
+            })
+    return jobs, clip_features, manifest.get('num_workers'), manifest.get('memory_per_worker')
+
+
+def init_batch_worker(clip_features, memory_per_worker):
+    """
+    Initializer of worker processes, keeping the clip features for all jobs of the worker.
+    :param (dict) clip_features: Clip features by mask path, from load_manifest().
+    :param (float) memory_per_worker: Memory limit in MB, None for no limit.
+    """
+    _clip_features.update(clip_features)
+    limit_worker_memory(memory_per_worker)
+
+
+def run_batch_job(job):
+    """
+    Creates the output of one job from load_manifest(), written to a temporary name first.
+    :param (dict) job: The job to run.
+    :return: (int) Number of polygons written, None if the clip area is outside the raster.
+    """
+    partial_path = get_partial_path(job['output'])
+    with rasterio.open(job['raster']) as src:
+        lon_res, lat_res = get_resolution(src, job['type'])
+        if job['roi_name'] is not None:
+            count = clip_province(
+                src=src,
+                data_type=job['type'],
+                roi_name=job['roi_name'],
+                roi_geometry=_clip_features[job['mask']][job['roi_name']],
+                longitude_in_meter=lon_res,
+                latitude_in_meter=lat_res,
+                target_resolution=job['target_resolution'],
+                path_to_export=partial_path,
+                prefix_to_export=None,
+                tile_size=job['tile_size'],
+                criteria=job['criteria'],
+                classes=job['classes']
+            )
+        elif job['tile_size'] is not None:
+            count = create_shapefile_tiled(
+                src=src,
+                data_type=job['type'],
+                path_to_export=partial_path,
+                prefix_to_export=None,
+                roi=None,
+                file_name=os.path.basename(job['raster']),
+                tile_size=job['tile_size'],
+                criteria=job['criteria'],
+                classes=job['classes'],
+                longitude_in_meter=lon_res,
+                latitude_in_meter=lat_res,
+                target_resolution=job['target_resolution']
+            )
+        else:
+            count = create_shapefile(
+                src=src,
+                data=src.read(1),
+                data_type=job['type'],
+                longitude_in_meter=lon_res,
+                latitude_in_meter=lat_res,
+                transform=src.transform,
+                target_resolution=job['target_resolution'],
+                path_to_export=partial_path,
+                prefix_to_export=None,
+                roi=None,
+                file_name=os.path.basename(job['raster']),
+                criteria=job['criteria'],
+                classes=job['classes']
+            )
+        if not os.path.exists(partial_path):
+            # keep an empty layer, so that jobs without polygons are not run again
+            with open_batch_writer(partial_path, src.crs, value_type=get_value_type(src.dtypes[0], job['classes'])):
+                pass
+    finalize_output(partial_path, job['output'])
+    return count
+
+
+def get_partial_path(path_to_export):
+    stem, extension = os.path.splitext(path_to_export)
+    return f"{stem}.partial{extension}"
+
+
+def finalize_output(partial_path, path_to_export):
+    """
+    Renames a completed output (with the sidecar files of a shapefile) from its temporary name.
+    :param (str) partial_path: Temporary path of the output.
+    :param (str) path_to_export: Final path of the output.
+    """
+    partial_stem = os.path.splitext(partial_path)[0]
+    export_stem = os.path.splitext(path_to_export)[0]
+    # the main file goes last, so that an interrupted rename is not taken as complete
+    for partial_file in sorted(glob.glob(glob.escape(partial_stem) + '.*'), key=lambda f: f == partial_path):
+        os.replace(partial_file, export_stem + partial_file[len(partial_stem):])
+
+
+def run_manifest(path_to_manifest):
+    """
+    Runs all jobs of the manifest in a process pool, skipping outputs that already exist.
+    :param (str) path_to_manifest: Path to the manifest in JSON.
+    :return: (dict) Number of polygons written for each output, None for failed or skipped ones.
+    """
+    jobs, clip_features, num_workers, memory_per_worker = load_manifest(path_to_manifest)
+    pending = [job for job in jobs if not os.path.exists(job['output'])]
+    print(f">> {len(jobs)} outputs in the manifest, {len(jobs) - len(pending)} already exist.")
+    if not pending:
+        return {}
+    num_workers = get_worker_count(num_workers, memory_per_worker)
+    print(f">> Running {len(pending)} jobs with {num_workers} worker processes.")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_batch_worker,
+                             initargs=(clip_features, memory_per_worker)) as pool:
+        futures = {pool.submit(run_batch_job, job): job['output'] for job in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Running jobs"):
+            output = futures[future]
+            try:
+                results[output] = future.result()
+            except Exception as e:
+                print(f"-! Error creating {output}: {e}.")
+                results[output] = None
+    failed = [output for output, count in results.items() if count is None and not os.path.exists(output)]
+    if failed:
+        print(f"-! {len(failed)} outputs failed, run the manifest again to retry them.")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("!! Usage: python get_forest_batch.py manifest.json")
+        sys.exit(1)
+    run_manifest(sys.argv[1])
+    print(">> The polygons have been saved to the destination.")
@@ -1,18 +1,74 @@
+import os
 import fiona
 import numpy as np
+import rasterio
+import shapely
 
+from affine import Affine
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from rasterio.enums import Resampling
-from rasterio.warp import reproject
-from rasterio.features import shapes
-from shapely.geometry import shape, mapping, Polygon
+from rasterio.errors import WindowError
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, transform_bounds
+from rasterio.features import shapes, geometry_mask, geometry_window, rasterize
+from rasterio.mask import mask
+from rasterio.windows import Window, bounds as window_bounds, from_bounds, transform as window_transform
+from shapely.affinity import affine_transform
+from shapely.geometry import shape, mapping, box, Polygon, MultiPolygon
+from shapely.strtree import STRtree
+from shapely.ops import unary_union
 from pyproj import CRS, Transformer
-from math import sqrt
 from tqdm import tqdm
 
+# default edge length (in pixels) of a tile in the tiled mode
+DEFAULT_TILE_SIZE = 4096
+# number of features buffered before each write to the export file
+DEFAULT_BATCH_SIZE = 20000
+# number of output rows computed at a time in block max-pool downsampling
+DEFAULT_CHUNK_ROWS = 256
+# edge length (in pixels) of a destination tile in the tiled reprojection
+DEFAULT_REPROJECT_TILE_SIZE = 1024
+# error allowed when transforming coordinates in the tiled reprojection, in pixels: GDAL approximates with
+# 0.125 by default, which makes the result depend on how the destination is split between different CRS
+DEFAULT_TRANSFORM_TOLERANCE = 0.125
+EXACT_TRANSFORM_TOLERANCE = 1e-9
+# reach of the resampling kernels in source pixels, scaled up when downsampling
+RESAMPLING_RADIUS = {
+    Resampling.bilinear: 2,
+    Resampling.cubic: 3,
+    Resampling.cubic_spline: 3,
+    Resampling.lanczos: 4
+}
+# equal-area projection for the area of polygons: pixel edges along parallels and meridians stay straight
+# in it, so the area of pixel polygons in a geographic CRS is exact on the WGS84 ellipsoid
+AREA_CRS = '+proj=cea +datum=WGS84 +units=m +no_defs'
+# band types accepted by rasterio.features.shapes()
+SHAPES_DTYPES = ('int16', 'int32', 'uint8', 'uint16', 'float32')
+# supported export formats by file extension
+VECTOR_DRIVERS = {
+    'shp': 'ESRI Shapefile',
+    'gpkg': 'GPKG',
+    'fgb': 'FlatGeobuf'
+}
+
 
 def create_shapefile(src, data, data_type, longitude_in_meter,
                      latitude_in_meter, transform, target_resolution,
-                     path_to_export, prefix_to_export, roi, file_name):
+                     path_to_export, prefix_to_export, roi, file_name, criteria=None, export_format='shp',
+                     classes=None, split_classes=False):
+    """
+    Converts the forest pixels into polygons, or the pixels of several classes at once with their band values
+    kept in raster_val.
+    :param (list) classes: Selection criteria of each class, see ask_class_criteria(). None to select the
+        forest class of data_type only, with raster_val 1.
+    :param (bool) split_classes: Export one file per class (suffixed with _class<value>) instead of one
+        combined file, used with classes.
+    :return: (int) Number of polygons written.
+    """
     data_array, new_transform = resample_data(
         src=src,
         data=data,
@@ -22,91 +78,736 @@ def create_shapefile(src, data, data_type, longitude_in_meter,
         crs=src.crs,
         target_resolution=target_resolution,
     )
-    # extract the forest class
-    if data_type == "CLCD":
-        forest_mask = data_array == 2
-    elif data_type == "GP":
-        # select band values not equal to 0
-        forest_mask = data_array != 0
+    if classes is not None:
+        # keep the band values, so that one pass gives the polygons of every class
+        band, forest_mask = extract_class_raster(data_array, classes)
     else:
-        forest_mask = get_selection_criteria(data_array)
+        # extract the forest class
+        forest_mask = extract_forest_mask(data_array, data_type, criteria)
+        band = forest_mask.astype(np.uint8)
     # convert the mask to polygons
     print(">> Reading shapes of pixels in target class...")
-    results = (
-        {'properties': {'raster_val': v}, 'geometry': s}
-        for i, (s, v) in enumerate(
-            shapes(forest_mask.astype(np.uint8), mask=forest_mask, transform=new_transform))
-    )
-    # define schema for the shapefile
-    schema = {
-        'geometry': 'Polygon',
-        'properties': {'raster_val': 'int'}
-    }
+    results = shapes(band, mask=forest_mask, transform=new_transform)
     print(">> Ready to start conversion..")
     # initialize progress bar
     total_polygons = np.sum(forest_mask)
     # check if any polygons to be output
     if total_polygons == 0:
         print(f"-! There is no plantation polygon detected in {file_name}.")
-        return
+        return 0
     else:
-        # pbar = tqdm(total=total_polygons, desc="Converting polygons")
-        # write the polygons to a shapefile
+        # write the polygons through one buffered handle
         if prefix_to_export is not None:
-            path_to_export = f"{path_to_export}/{prefix_to_export}_{file_name}.shp"
-            with fiona.open(path_to_export, 'w', driver='ESRI Shapefile', crs=src.crs, schema=schema) as out:
-                feature_count = 0
-                for elem in results:
-                    poly = shape(elem['geometry'])
-                    if isinstance(poly, Polygon) and poly.intersects(roi):
-                        feature_count += 1
-                        intersection = poly.intersection(roi)
-                        if not intersection.is_empty:
-                            out.write({
-                                'geometry': mapping(intersection),
-                                'properties': {'raster_val': elem['properties']['raster_val']}
-                            })
-        else:
-            for elem in results:
-                with fiona.open(path_to_export, 'w', driver='ESRI Shapefile', crs=src.crs, schema=schema) as out:
-                    out.write({
-                        'geometry': mapping(shape(elem['geometry'])),
-                        'properties': {'raster_val': elem['properties']['raster_val']}
-                    })
-                # pbar.update(1)
-        # pbar.close()  # close progress bar when done
+            path_to_export = get_export_path(path_to_export, prefix_to_export, file_name, export_format)
+        if roi is not None:
+            # rasterize the roi onto the grid once, so that most polygons skip the geometry tests
+            prepared_roi = prepare_roi(roi)
+            roi_masks = get_roi_pixel_masks(roi, forest_mask.shape, new_transform)
+            clip_counter = {'inside': 0, 'outside': 0, 'boundary': 0}
+        feature_count = 0
+        value_type = get_value_type(band.dtype, classes)
+        with open_class_writer(path_to_export, src.crs, classes if split_classes else None, value_type) as write:
+            for geometry, value in results:
+                poly = shape(geometry)
+                if roi is not None:
+                    poly = clip_polygon_to_roi(poly, prepared_roi, clip_counter, roi_masks, new_transform)
+                    if poly is None:
+                        continue
+                feature_count += 1
+                write({
+                    'geometry': poly,
+                    'properties': {'raster_val': value}
+                })
+        if roi is not None:
+            print_clip_counter(clip_counter)
         print(f">> Finish processing forest polygons in {file_name}, with {feature_count} polygons in total.")
+        return feature_count
 
 
-def degrees_to_meters(latitude, longitude, latitude_resolution, longitude_resolution):
+def create_shapefile_tiled(src, data_type, path_to_export, prefix_to_export, roi, file_name,
+                           tile_size=DEFAULT_TILE_SIZE, criteria=None, export_format='shp',
+                           classes=None, split_classes=False, longitude_in_meter=None, latitude_in_meter=None,
+                           target_resolution=None):
     """
-    Converts resolution from degrees to meters at the given latitude and longitude.
-    :param latitude:
-    :param longitude:
-    :param latitude_resolution:
-    :param longitude_resolution:
-    :return:
+    Converts the forest pixels into polygons tile by tile, so that peak memory depends on the tile size
+    rather than the raster size. Polygons crossing tile seams are stitched before being written,
+    giving the same polygons as create_shapefile() in a single pass.
+    :param src: rasterio dataset, opened in read mode.
+    :param (str) data_type: CLCD, GP or others.
+    :param (str) path_to_export: Path to the export file, or the export folder if prefix_to_export is given.
+    :param (str) prefix_to_export: Prefix for export files, None to export to path_to_export directly.
+    :param roi: shapely geometry to clip with, None to process the whole raster.
+    :param (str) file_name: Name of the region, used in the export file name.
+    :param (int) tile_size: Edge length of a tile in pixels.
+    :param (tuple) criteria: Selection criteria for type others, see ask_selection_criteria().
+    :param (str) export_format: shp, gpkg or fgb, used with prefix_to_export.
+    :param (list) classes: Selection criteria of each class, see create_shapefile().
+    :param (bool) split_classes: Export one file per class, see create_shapefile().
+    :param (float) longitude_in_meter: Pixel width in meters, used with target_resolution.
+    :param (float) latitude_in_meter: Pixel height in meters, used with target_resolution.
+    :param (float) target_resolution: Target resolution in meters, None for no resampling. Each tile is
+        resampled on its own when the target resolution is a whole number of pixels, otherwise the region
+        is read at once as in create_shapefile().
+    :return: (int) Number of polygons written, None if the roi is outside the raster.
     """
+    if data_type not in ("CLCD", "GP") and criteria is None and classes is None:
+        criteria = ask_selection_criteria()
+    # limit the tiles to the bounding rectangle of the roi, as mask(crop=True) does
+    if roi is not None:
+        bbox = box(*roi.bounds)
+        try:
+            region = geometry_window(src, [mapping(bbox)])
+        except WindowError:
+            print(f"-! The raster does not overlap with {file_name}.")
+            return None
+    else:
+        bbox = None
+        region = Window(0, 0, src.width, src.height)
+    factor = (1, 1)
+    if target_resolution:
+        lon_m, lat_m = get_data_resolution(src.window_transform(region), (int(region.height), int(region.width)),
+                                           src.crs, longitude_in_meter, latitude_in_meter)
+        factor = get_resample_factor(lon_m, lat_m, target_resolution)
+        if factor is None:
+            # the new pixels do not cover whole tiles, so the tiles cannot be resampled on their own
+            print("-! The target resolution is not a whole number of pixels, which the tiled mode cannot "
+                  "resample. Reading the whole raster instead.")
+            if roi is not None:
+                return clip_province(src, data_type, file_name, roi, longitude_in_meter, latitude_in_meter,
+                                     target_resolution, path_to_export, prefix_to_export, tile_size=None,
+                                     criteria=criteria, export_format=export_format, classes=classes,
+                                     split_classes=split_classes)
+            if prefix_to_export is not None:
+                path_to_export = get_export_path(path_to_export, prefix_to_export, file_name, export_format)
+            return create_shapefile(src, src.read(1), data_type, longitude_in_meter, latitude_in_meter,
+                                    src.transform, target_resolution, path_to_export, None, None, file_name,
+                                    criteria=criteria, classes=classes, split_classes=split_classes)
+        print(f">> Resampling the tiles by {factor[0]} x {factor[1]} blocks...")
+    factor_x, factor_y = factor
+    if prefix_to_export is not None:
+        path_to_export = get_export_path(path_to_export, prefix_to_export, file_name, export_format)
+    # stitching is done in pixel coordinates of the (resampled) region, where seams fall on exact integers
+    origin = (region.col_off, region.row_off)
+    grid = src.window_transform(region) * Affine.scale(factor_x, factor_y)
+    grid_region = to_grid_window(region, origin, factor)
+    world_params = [grid.a, grid.b, grid.d, grid.e, grid.xoff, grid.yoff]
+
+    # polygons inside a tile are clipped with the roi rasterized on the tile, while stitched polygons may
+    # span many tiles, so they go through the exact path
+    if roi is not None:
+        prepared_roi = prepare_roi(roi)
+        clip_counter = {'inside': 0, 'outside': 0, 'boundary': 0}
+
+    print(">> Reading shapes of pixels in target class by tiles...")
+    feature_count = 0
+    value_type = get_value_type(src.dtypes[0], classes)
+    with open_class_writer(path_to_export, src.crs, classes if split_classes else None, value_type) as write:
+        def emit(pixel_poly, value, roi_masks=None, mask_transform=None):
+            nonlocal feature_count
+            poly = affine_transform(pixel_poly, world_params)
+            if roi is not None:
+                poly = clip_polygon_to_roi(poly, prepared_roi, clip_counter, roi_masks, mask_transform)
+                if poly is None:
+                    return
+            feature_count += 1
+            write({
+                'geometry': poly,
+                'properties': {'raster_val': value}
+            })
+
+        tile_rows = get_tile_windows(src, tile_size, region, factor)
+        carried = {}  # polygons touching the bottom seam of the previous tile row, by band value
+        for row_idx, tile_row in enumerate(tqdm(tile_rows, desc="Polygonizing tile rows")):
+            is_last_row = row_idx == len(tile_rows) - 1
+            first_tile = to_grid_window(tile_row[0], origin, factor)
+            row_bottom = first_tile.row_off + first_tile.height
+            pending = {value: list(polys) for value, polys in carried.items()}
+            for window in tile_row:
+                polygons = polygonize_window(src, window, data_type, criteria, bbox, classes, factor, origin)
+                tile = to_grid_window(window, origin, factor)
+                roi_masks, mask_transform = None, None
+                if roi is not None and polygons:
+                    # padded by a pixel, so the boundary just outside the tile is marked around its edges
+                    padded = Window(tile.col_off - 1, tile.row_off - 1, tile.width + 2, tile.height + 2)
+                    mask_transform = window_transform(padded, grid)
+                    roi_masks = get_roi_pixel_masks(roi, (padded.height, padded.width), mask_transform)
+                for poly, value in polygons:
+                    if touches_seam(poly, tile, grid_region):
+                        pending.setdefault(value, []).append(poly)
+                    else:
+                        emit(poly, value, roi_masks, mask_transform)
+            # merge the pieces across seams within this row and with the carried polygons,
+            # never across different classes
+            carried = {}
+            for value, polys in pending.items():
+                for poly in explode_polygons(unary_union(polys)):
+                    if not is_last_row and poly.bounds[3] >= row_bottom:
+                        carried.setdefault(value, []).append(poly)
+                    else:
+                        emit(poly, value)
+
+    if roi is not None:
+        print_clip_counter(clip_counter)
+    if feature_count == 0:
+        print(f"-! There is no plantation polygon detected in {file_name}.")
+    else:
+        print(f">> Finish processing forest polygons in {file_name}, with {feature_count} polygons in total.")
+    return feature_count
+
+
+def get_tile_windows(src, tile_size, region, factor=(1, 1)):
+    """
+    Splits a region of the raster into tiles, aligned to the internal blocks where possible.
+    :param src: rasterio dataset.
+    :param (int) tile_size: Edge length of a tile in pixels.
+    :param (Window) region: Region of the raster to split.
+    :param (tuple) factor: Numbers of columns and rows merged into a new pixel when resampling, the tiles
+        are a multiple of them, so that no new pixel spans two tiles.
+    :return: (list) Rows of tiles, each a list of rasterio Window.
+    """
+    def get_tile_length(block, factor):
+        # a multiple of both the block and the factor if it fits in the tile, of the factor only otherwise
+        step = int(np.lcm(block, factor))
+        if step > tile_size:
+            step = factor
+        return max(tile_size // step, 1) * step
+
+    block_height, block_width = src.block_shapes[0]
+    tile_height = get_tile_length(block_height, factor[1])
+    tile_width = get_tile_length(block_width, factor[0])
+    row_start, col_start = int(region.row_off), int(region.col_off)
+    row_stop, col_stop = row_start + int(region.height), col_start + int(region.width)
+    return [
+        [Window(j, i, min(tile_width, col_stop - j), min(tile_height, row_stop - i))
+         for j in range(col_start, col_stop, tile_width)]
+        for i in range(row_start, row_stop, tile_height)
+    ]
+
+
+def to_grid_window(window, origin, factor):
+    """
+    :return: (Window) The window in pixels of the raster resampled by factor from origin (column, row),
+        partial pixels at its far edges included.
+    """
+    factor_x, factor_y = factor
+    return Window((int(window.col_off) - int(origin[0])) // factor_x,
+                  (int(window.row_off) - int(origin[1])) // factor_y,
+                  -(-int(window.width) // factor_x), -(-int(window.height) // factor_y))
+
+
+def polygonize_window(src, window, data_type, criteria=None, bbox=None, classes=None, factor=(1, 1),
+                      origin=(0, 0)):
+    """
+    Reads a window of the first band and converts its forest pixels into polygons in pixel coordinates
+    of the raster resampled by factor from origin, the full raster by default.
+    :param src: rasterio dataset.
+    :param (Window) window: Window to read, starting on a new pixel when resampling.
+    :param (str) data_type: CLCD, GP or others.
+    :param (tuple) criteria: Selection criteria for type others.
+    :param bbox: shapely geometry, pixels centred outside of it are dropped as mask() does.
+    :param (list) classes: Selection criteria of each class, None for the forest class only.
+    :param (tuple) factor: Numbers of columns and rows merged into a new pixel by their maximum, as
+        resample_data() does.
+    :param (tuple) origin: Column and row of the raster where the resampled pixels start.
+    :return: (list) Tuples of shapely Polygon and its band value (1 for the forest class only).
+    """
+    factor_x, factor_y = factor
+    data = src.read(1, window=window)
+    if factor != (1, 1):
+        if bbox is not None:
+            # fill the pixels outside before resampling, as mask() does
+            outside = geometry_mask([mapping(bbox)], data.shape, src.window_transform(window))
+            data[outside] = src.nodata if src.nodata is not None else 0
+            bbox = None
+        data = block_max_downsample(data, factor_x, factor_y, tail='pad')
+    if classes is not None:
+        band, forest_mask = extract_class_raster(data, classes)
+    else:
+        forest_mask = extract_forest_mask(data, data_type, criteria)
+        band = None
+    if bbox is not None:
+        forest_mask &= ~geometry_mask([mapping(bbox)], forest_mask.shape, src.window_transform(window))
+    if not forest_mask.any():
+        return []
+    if band is None:
+        band = forest_mask.astype(np.uint8)
+    tile = to_grid_window(window, origin, factor)
+    offset = Affine.translation(tile.col_off, tile.row_off)
+    return [(shape(s), v) for s, v in shapes(band, mask=forest_mask, transform=offset)]
+
+
+def touches_seam(poly, window, region):
+    """
+    Checks if a polygon in pixel coordinates reaches an edge of its tile shared with another tile.
+    :param poly: shapely Polygon in pixel coordinates.
+    :param (Window) window: The tile the polygon came from.
+    :param (Window) region: The region being tiled.
+    :return: (bool)
+    """
+    minx, miny, maxx, maxy = poly.bounds
+    return ((minx <= window.col_off and window.col_off > region.col_off)
+            or (maxx >= window.col_off + window.width
+                and window.col_off + window.width < region.col_off + region.width)
+            or (miny <= window.row_off and window.row_off > region.row_off)
+            or (maxy >= window.row_off + window.height
+                and window.row_off + window.height < region.row_off + region.height))
+
+
+def explode_polygons(geom):
+    """
+    Splits a merged geometry into its polygons.
+    :param geom: shapely Polygon or MultiPolygon.
+    :return: (list) shapely Polygons.
+    """
+    if isinstance(geom, Polygon):
+        return [geom]
+    return [g for g in getattr(geom, 'geoms', []) if isinstance(g, Polygon)]
+
+
+def clip_province(src, data_type, roi_name, roi_geometry, longitude_in_meter, latitude_in_meter,
+                  target_resolution, path_to_export, prefix_to_export, tile_size=None, criteria=None,
+                  export_format='shp', classes=None, split_classes=False):
+    """
+    Clips the raster to the bounding rectangle of a province and converts its forest pixels into polygons,
+    exported to prefix_province.shp (or .gpkg / .fgb) in the export folder.
+    :param src: rasterio dataset, opened in read mode.
+    :param (str) data_type: CLCD, GP or others.
+    :param (str) roi_name: Name of the province.
+    :param roi_geometry: shapely geometry of the province.
+    :param (float) longitude_in_meter: Pixel width in meters.
+    :param (float) latitude_in_meter: Pixel height in meters.
+    :param (float) target_resolution: Target resolution in meters, None for no resampling.
+    :param (str) path_to_export: Folder for export files.
+    :param (str) prefix_to_export: Prefix for export files.
+    :param (int) tile_size: Edge length of a tile in pixels, None to process the clipped raster at once.
+    :param (tuple) criteria: Selection criteria for type others, see ask_selection_criteria().
+    :param (str) export_format: shp, gpkg or fgb.
+    :param (list) classes: Selection criteria of each class, see create_shapefile().
+    :param (bool) split_classes: Export one file per class, see create_shapefile().
+    :return: (int) Number of polygons written, None if the province is outside the raster.
+    """
+    print(f">> Now clipping area of {roi_name}.")
+    if tile_size is not None:
+        return create_shapefile_tiled(
+            src=src,
+            data_type=data_type,
+            path_to_export=path_to_export,
+            prefix_to_export=prefix_to_export,
+            roi=roi_geometry,
+            file_name=roi_name,
+            tile_size=tile_size,
+            criteria=criteria,
+            export_format=export_format,
+            classes=classes,
+            split_classes=split_classes,
+            longitude_in_meter=longitude_in_meter,
+            latitude_in_meter=latitude_in_meter,
+            target_resolution=target_resolution
+        )
+    # get the minimum bounding rectangle of the roi geometry
+    minx, miny, maxx, maxy = roi_geometry.bounds
+    bbox = box(minx, miny, maxx, maxy)
+    # clip the raster with the roi geometry
+    try:
+        clipped_image, clipped_transform = mask(src, [mapping(bbox)], crop=True)
+    except ValueError:
+        return None
+    # convert pixels and create shapefile
+    return create_shapefile(
+        src=src,
+        data=clipped_image[0],  # first band only
+        data_type=data_type,
+        longitude_in_meter=longitude_in_meter,
+        latitude_in_meter=latitude_in_meter,
+        transform=clipped_transform,
+        target_resolution=target_resolution,
+        path_to_export=path_to_export,
+        prefix_to_export=prefix_to_export,
+        roi=roi_geometry,
+        file_name=roi_name,
+        criteria=criteria,
+        export_format=export_format,
+        classes=classes,
+        split_classes=split_classes
+    )
+
+
+def clip_province_job(path_to_tif, data_type, roi_name, roi_geometry, longitude_in_meter, latitude_in_meter,
+                      target_resolution, path_to_export, prefix_to_export, tile_size=None, criteria=None,
+                      export_format='shp', classes=None, split_classes=False):
+    """
+    Runs clip_province() in a worker process, which opens the raster by itself.
+    :return: (tuple) Name of the province and number of polygons written.
+    """
+    with rasterio.open(path_to_tif) as src:
+        count = clip_province(src, data_type, roi_name, roi_geometry, longitude_in_meter, latitude_in_meter,
+                              target_resolution, path_to_export, prefix_to_export, tile_size, criteria,
+                              export_format, classes, split_classes)
+    return roi_name, count
+
+
+def clip_provinces_in_parallel(path_to_tif, path_to_mask, data_type, longitude_in_meter, latitude_in_meter,
+                               target_resolution, path_to_export, prefix_to_export, tile_size=None,
+                               criteria=None, export_format='shp', num_workers=None, memory_per_worker=None,
+                               classes=None, split_classes=False):
+    """
+    Processes every feature of the clip mask as a separate job in a process pool.
+    See clip_province() for the parameters not listed here.
+    :param (str) path_to_tif: Path to the raster file.
+    :param (str) path_to_mask: Path to the clip features, with the name of each feature in property Province.
+    :param (int) num_workers: Number of worker processes, default to the number of CPUs.
+    :param (float) memory_per_worker: Memory limit of each worker in MB, None for no limit.
+        Also caps the number of workers to what the physical memory can hold.
+    :return: (dict) Number of polygons written for each province, None for failed or skipped ones.
+    """
+    num_workers = get_worker_count(num_workers, memory_per_worker)
+    provinces = load_clip_features(path_to_mask)
+    print(f">> Clipping {len(provinces)} areas with {num_workers} worker processes.")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=limit_worker_memory,
+                             initargs=(memory_per_worker,)) as pool:
+        futures = {
+            pool.submit(clip_province_job, path_to_tif, data_type, roi_name, roi_geometry,
+                        longitude_in_meter, latitude_in_meter, target_resolution,
+                        path_to_export, prefix_to_export, tile_size, criteria, export_format,
+                        classes, split_classes): roi_name
+            for roi_name, roi_geometry in provinces
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Clipping areas"):
+            roi_name = futures[future]
+            try:
+                _, results[roi_name] = future.result()
+            except MemoryError:
+                print(f"-! Worker ran out of memory while processing {roi_name}.")
+                results[roi_name] = None
+            except BrokenProcessPool as e:
+                print(f"-! Worker was killed while processing {roi_name}: {e}.")
+                results[roi_name] = None
+            except Exception as e:
+                print(f"-! Error processing {roi_name}: {e}.")
+                results[roi_name] = None
+    return results
+
+
+def load_clip_features(path_to_mask):
+    """
+    Loads the clip features with their names.
+    :param (str) path_to_mask: Path to the clip features, with the name of each feature in property Province.
+    :return: (list) Tuples of the name and the shapely geometry of each feature.
+    """
+    with fiona.open(path_to_mask, 'r') as roi:
+        return [(province['properties']['Province'], shape(province['geometry'])) for province in roi]
+
+
+def get_worker_count(num_workers=None, memory_per_worker=None):
+    """
+    Decides the number of worker processes from the CPU count and the memory limit of each worker.
+    :param (int) num_workers: Requested number of workers, default to the number of CPUs.
+    :param (float) memory_per_worker: Memory limit of each worker in MB.
+    :return: (int) Number of workers.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if memory_per_worker is not None:
+        try:
+            total_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 2
+            num_workers = min(num_workers, int(total_memory // memory_per_worker))
+        except (ValueError, OSError, AttributeError):
+            pass
+    return max(1, num_workers)
+
+
+def limit_worker_memory(memory_per_worker):
+    """
+    Initializer of worker processes, limiting the address space of the worker to memory_per_worker MB.
+    :param (float) memory_per_worker: Memory limit in MB, None for no limit.
+    """
+    if memory_per_worker is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("-! Memory limit per worker is not supported on this platform.")
+        return
+    limit = int(memory_per_worker * 1024 ** 2)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def prepare_roi(roi):
+    """
+    Prepares the roi for repeated geometry tests, with its parts indexed in an STRtree,
+    so that each polygon is intersected with the nearby parts only.
+    :param roi: shapely Polygon or MultiPolygon.
+    :return: (dict) The prepared geometry, its parts and the tree of the parts.
+    """
+    parts = list(getattr(roi, 'geoms', [roi]))
+    shapely.prepare(roi)
+    shapely.prepare(parts)
+    return {'geometry': roi, 'parts': parts, 'tree': STRtree(parts)}
+
+
+def get_roi_pixel_masks(roi, out_shape, transform):
+    """
+    Rasterizes the roi onto the grid, marking the pixels centred inside the roi and the pixels crossed by
+    (or next to) its boundary. A pixel away from the boundary lies either entirely inside or entirely
+    outside the roi. Both masks take one byte per pixel, as the raster they index.
+    :param roi: shapely geometry.
+    :param (tuple) out_shape: Shape of the grid.
+    :param (Affine) transform: Transform of the grid.
+    :return: (tuple) Boolean masks of the pixels centred inside the roi, and of the boundary pixels.
+    """
+    # rasterized as uint8 and viewed as bool, without a copy
+    inside = rasterize([roi], out_shape=out_shape, transform=transform, fill=0, default_value=1,
+                       dtype=np.uint8).view(bool)
+    boundary = rasterize([roi.boundary], out_shape=out_shape, transform=transform, fill=0, default_value=1,
+                         all_touched=True, dtype=np.uint8).view(bool)
+    # grow the boundary by one pixel to stay safe with lines running along pixel edges
+    grown = boundary.copy()
+    grown[1:, :] |= boundary[:-1, :]
+    grown[:-1, :] |= boundary[1:, :]
+    grown[:, 1:] |= boundary[:, :-1]
+    grown[:, :-1] |= boundary[:, 1:]
+    return inside, grown
+
+
+def clip_polygon_to_roi(poly, prepared_roi, counter, roi_masks=None, transform=None):
+    """
+    Clips a polygon to the roi. With the pixel masks of the roi, polygons away from the roi boundary are
+    kept or dropped by a lookup in the masks; the others are intersected with the nearby parts of the roi.
+    :param poly: shapely Polygon.
+    :param (dict) prepared_roi: Output of prepare_roi().
+    :param (dict) counter: Number of polygons taking each path (inside, outside, boundary), updated in place.
+    :param (tuple) roi_masks: Output of get_roi_pixel_masks(), None to test every polygon exactly.
+    :param (Affine) transform: Transform of the grid the masks were rasterized on.
+    :return: shapely Polygon or MultiPolygon clipped to the roi, None if no area is left.
+    """
+    if roi_masks is not None:
+        inside, boundary = roi_masks
+        minx, miny, maxx, maxy = poly.bounds
+        cols, rows = ~transform * (np.array([minx, maxx]), np.array([maxy, miny]))
+        row0, row1 = int(round(min(rows))), int(round(max(rows)))
+        col0, col1 = int(round(min(cols))), int(round(max(cols)))
+        # pixel polygons are small, so the slice of their bounding box is cheap to scan
+        if not boundary[row0:row1, col0:col1].any():
+            if inside[row0, col0]:
+                counter['inside'] += 1
+                return poly
+            counter['outside'] += 1
+            return None
+    counter['boundary'] += 1
+    roi = prepared_roi['geometry']
+    if not (isinstance(poly, Polygon) and roi.intersects(poly)):
+        return None
+    if roi.contains_properly(poly):
+        return poly
+    parts = prepared_roi['parts']
+    pieces = [poly.intersection(parts[i]) for i in prepared_roi['tree'].query(poly, predicate='intersects')]
+    intersection = pieces[0] if len(pieces) == 1 else unary_union(pieces)
+    return get_polygonal_part(intersection)
+
+
+def get_polygonal_part(geom):
+    """
+    Keeps the polygons of a clipped geometry, dropping the points and lines left where the polygon only
+    touches the roi at a vertex or along an edge.
+    :param geom: shapely geometry.
+    :return: shapely Polygon or MultiPolygon, None if no area is left.
+    """
+    # the parts of a geometry collection may be multi-polygons themselves
+    polygons = [part for part in shapely.get_parts(shapely.get_parts(geom))
+                if isinstance(part, Polygon) and part.area > 0]
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+
+def print_clip_counter(counter):
+    print(f">> Clipping paths: {counter['inside']} polygons kept and {counter['outside']} dropped by the roi "
+          f"raster, {counter['boundary']} tested against the roi geometry.")
+
+
+def get_export_path(path_to_export, prefix_to_export, file_name, export_format='shp'):
+    """
+    Builds the path of an export file in the format of prefix_name.ext.
+    :param (str) path_to_export: Folder for export files.
+    :param (str) prefix_to_export: Prefix for export files.
+    :param (str) file_name: Name of the region.
+    :param (str) export_format: shp, gpkg or fgb.
+    :return: (str) Path to the export file.
+    """
+    return f"{path_to_export}/{prefix_to_export}_{file_name}.{export_format}"
+
+
+@contextmanager
+def open_batch_writer(path_to_export, crs, batch_size=DEFAULT_BATCH_SIZE, value_type='int'):
+    """
+    Opens a vector file for polygons with properties raster_val and area_m2, and buffers the features so
+    that they are written in batches (one transaction per batch for GeoPackage) instead of one call per
+    feature. The area is computed for each batch at once, see get_geodesic_areas().
+    The driver follows the file extension: .shp, .gpkg or .fgb.
+    :param (str) path_to_export: Path to the export file.
+    :param crs: Coordinate reference system of the features.
+    :param (int) batch_size: Number of features to buffer before each write.
+    :param (str) value_type: Field type of raster_val, int or float, see get_value_type().
+    :return: A function taking one feature to write, with a shapely geometry and property raster_val.
+    """
+    extension = os.path.splitext(path_to_export)[1].lstrip('.').lower()
+    if extension not in VECTOR_DRIVERS:
+        raise ValueError(f"Unsupported export format .{extension}, please use one of "
+                         f"{', '.join('.' + ext for ext in VECTOR_DRIVERS)}.")
+    schema = {
+        # clipped polygons may become multi-polygons, so every polygon is written as one, and any other
+        # geometry type fails to write instead of entering the layer
+        'geometry': 'MultiPolygon',
+        'properties': {'raster_val': value_type, 'area_m2': 'float'}
+    }
+    # float bands are polygonized as float32, written as the shortest decimal of the float32 value (0.65,
+    # not 0.6499999761581421)
+    to_value = (lambda value: float(str(np.float32(value)))) if value_type == 'float' else int
+    buffer = []
+    with fiona.open(path_to_export, 'w', driver=VECTOR_DRIVERS[extension], crs=crs, schema=schema) as out:
+        def flush():
+            areas = get_geodesic_areas([feature['geometry'] for feature in buffer], crs)
+            out.writerecords({
+                'geometry': mapping(to_multipolygon(feature['geometry'])),
+                'properties': {**feature['properties'], 'raster_val': to_value(feature['properties']['raster_val']),
+                               'area_m2': float(area)}
+            } for feature, area in zip(buffer, areas))
+            buffer.clear()
+
+        def write(feature):
+            buffer.append(feature)
+            if len(buffer) >= batch_size:
+                flush()
+
+        yield write
+        if buffer:
+            flush()
+
+
+def to_multipolygon(geom):
+    """
+    :param geom: shapely geometry.
+    :return: A Polygon promoted to MultiPolygon, other geometries unchanged.
+    """
+    return MultiPolygon([geom]) if isinstance(geom, Polygon) else geom
+
+
+def get_geodesic_areas(geometries, crs):
+    """
+    Computes the area of polygons on the WGS84 ellipsoid, projecting the coordinates of all polygons in one
+    call to an equal-area projection.
+    :param (list) geometries: shapely geometries.
+    :param crs: Coordinate reference system of the geometries, None to return their planar area.
+    :return: (np.ndarray) Area of each geometry in square meters.
+    """
+    if crs is None:
+        return shapely.area(geometries)
+    transformer = get_area_transformer(CRS.from_user_input(crs).to_wkt())
+    projected = shapely.transform(geometries, lambda coords: np.column_stack(
+        transformer.transform(coords[:, 0], coords[:, 1])))
+    return shapely.area(projected)
+
+
+@lru_cache(maxsize=None)
+def get_area_transformer(crs_wkt):
+    return Transformer.from_crs(CRS.from_wkt(crs_wkt), CRS.from_proj4(AREA_CRS), always_xy=True)
+
+
+@contextmanager
+def open_class_writer(path_to_export, crs, classes=None, value_type='int'):
+    """
+    Opens the export file, or one export file per class when classes are given. The file of a class is
+    named after the export file with suffix _class<value> (or _class<min>-<max> for a range), and is
+    created with its first polygon.
+    :param (str) path_to_export: Path to the export file.
+    :param crs: Coordinate reference system of the features.
+    :param (list) classes: Selection criteria of each class, None to write all features into one file.
+    :param (str) value_type: Field type of raster_val, int or float, see get_value_type().
+    :return: A function taking one feature to write, with the band value in property raster_val.
+    """
+    if classes is None:
+        with open_batch_writer(path_to_export, crs, value_type=value_type) as write:
+            yield write
+        return
+    stem, extension = os.path.splitext(path_to_export)
+    with ExitStack() as stack:
+        writers = {}
+
+        def write(feature):
+            label = get_class_label(feature['properties']['raster_val'], classes)
+            if label not in writers:
+                writers[label] = stack.enter_context(open_batch_writer(f"{stem}_class{label}{extension}", crs,
+                                                                       value_type=value_type))
+            writers[label](feature)
+
+        yield write
+
+
+def get_value_type(dtype, classes=None):
+    """
+    Chooses the field type of raster_val: the band values of classes are kept as they are, floats for a
+    floating-point band, while the forest class only is written as 1.
+    :param dtype: Data type of the band.
+    :param (list) classes: Selection criteria of each class, None for the forest class only.
+    :return: (str) float or int.
+    """
+    return 'float' if classes is not None and np.issubdtype(np.dtype(dtype), np.floating) else 'int'
+
+
+def get_class_label(value, classes):
+    """
+    Finds the class of a band value.
+    :param value: Band value.
+    :param (list) classes: Selection criteria of each class.
+    :return: (str) The value for a class of one value, or min-max for a class of a range.
+    """
+    for criteria in classes:
+        if criteria[0] == 'value' and value == criteria[1]:
+            return f"{criteria[1]:g}"
+        if criteria[0] == 'range' and criteria[1] <= value <= criteria[2]:
+            return f"{criteria[1]:g}-{criteria[2]:g}"
+    raise ValueError(f"Band value {value} is not in any of the selected classes.")
 
-    # define WGS84 coordinate system
-    wgs84 = CRS.from_epsg(4326)
-    # define a local UTM zone coordinate system
-    utm_zone = get_utm_zone(longitude)
-    utm = CRS.from_proj4(f"+proj=utm +zone={utm_zone} +datum=WGS84")
 
-    transformer = Transformer.from_crs(wgs84, utm, always_xy=True)
+def degrees_to_meters(latitude, longitude, latitude_resolution, longitude_resolution):
+    """
+    Converts resolution from degrees to meters at the given latitude and longitude, in the UTM zone of the
+    longitude. Latitudes may be given as an array, e.g. the centre of every row of a raster.
+    :param latitude: Latitude in degrees, a number or an array.
+    :param longitude: Longitude in degrees, a number or an array (the UTM zone follows their mean).
+    :param (float) latitude_resolution: Pixel height in degrees.
+    :param (float) longitude_resolution: Pixel width in degrees.
+    :return: (tuple) Pixel width and height in meters, numbers or arrays following the input.
+    """
+    transformer = get_utm_transformer(get_utm_zone(float(np.mean(longitude))))
+    latitude, longitude = np.broadcast_arrays(np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float))
 
     # convert latitude and longitude resolution to meters
     lon1, lat1 = transformer.transform(longitude, latitude)
     lon2, _ = transformer.transform(longitude + longitude_resolution, latitude)
-    _, lat3 = transformer.transform(longitude, latitude_resolution + latitude)
-
-    longitude_res_in_meter = sqrt((lon2 - lon1) ** 2)
-    latitude_res_in_meter = sqrt((lat3 - lat1) ** 2)
+    _, lat3 = transformer.transform(longitude, latitude + latitude_resolution)
 
+    longitude_res_in_meter = np.abs(np.asarray(lon2) - lon1)
+    latitude_res_in_meter = np.abs(np.asarray(lat3) - lat1)
+    if longitude_res_in_meter.ndim == 0:
+        return float(longitude_res_in_meter), float(latitude_res_in_meter)
     return longitude_res_in_meter, latitude_res_in_meter
 
 
+@lru_cache(maxsize=None)
+def get_utm_transformer(utm_zone):
+    """
+    Builds the transformer from WGS84 to a UTM zone, once per zone.
+    :param (int) utm_zone: UTM zone ID.
+    :return: pyproj Transformer.
+    """
+    wgs84 = CRS.from_epsg(4326)
+    utm = CRS.from_proj4(f"+proj=utm +zone={utm_zone} +datum=WGS84")
+    return Transformer.from_crs(wgs84, utm, always_xy=True)
+
+
 def get_raster_type():
     print("-- Please select the following pre-defined types of your input raster:")
     print("   [A] CLCD images (albert, 30m), [B] Global Plantation Products (WGS84, 0.0003deg), [C] Others.")
@@ -128,12 +829,15 @@ def get_raster_type():
         return get_raster_type()
 
 
-def get_resample_info(src, raster_type):
-    # read the first band only
-    data = src.read(1)
+def get_resample_info(src, raster_type, read_data=True):
+    # read the first band only (skipped in the tiled mode, where the raster is read by windows)
+    data = src.read(1) if read_data else None
     # display current resolution
     lon_m, lat_m = get_resolution(src, raster_type)
     print(f"-- Current resolution: {lon_m:.2f} meters x {lat_m:.2f} meters.")
+    row_lon_m, _ = get_row_resolution(src)
+    if row_lon_m.max() - row_lon_m.min() > 0.01 * lon_m:
+        print(f"-- Pixel width varies from {row_lon_m.min():.2f} to {row_lon_m.max():.2f} meters over the rows.")
     # ask if perform resampling
     print("!! NOTICE: This software is unstable in resampling raster. We are still working on it and please use it "
           "with caution.")
@@ -150,17 +854,72 @@ def get_resample_info(src, raster_type):
 
 
 def get_selection_criteria(d):
+    return apply_selection_criteria(d, ask_selection_criteria())
+
+
+def ask_selection_criteria():
+    """
+    Asks for the band value or range of the target class once, so that it can be reused over tiles.
+    :return: (tuple) ('value', value) or ('range', min_val, max_val).
+    """
     criteria_type = input("Select a range or a specific band value? (value/range): ").strip().lower()
     if criteria_type == 'value':
         value = int(input("Please enter the band value to select: ").strip())
-        return d == value
+        return 'value', value
     elif criteria_type == 'range':
         min_val = float(input("Please enter the lower range of band value: ").strip())
         max_val = float(input("Please enter the upper range of band value: ").strip())
-        return (d >= min_val) & (d <= max_val)
+        return 'range', min_val, max_val
     else:
         print("Invalid input. Please enter 'value' or 'range'.")
-        return get_selection_criteria(d)
+        return ask_selection_criteria()
+
+
+def apply_selection_criteria(d, criteria):
+    """
+    Selects pixels matching the criteria from ask_selection_criteria().
+    :param (np.ndarray) d: Band values.
+    :param (tuple) criteria: ('value', value) or ('range', min_val, max_val).
+    :return: (np.ndarray) Boolean mask of the selected pixels.
+    """
+    if criteria[0] == 'value':
+        return d == criteria[1]
+    else:
+        return (d >= criteria[1]) & (d <= criteria[2])
+
+
+def extract_forest_mask(data, data_type, criteria=None):
+    """
+    Extracts the mask of the forest class from the band values.
+    :param (np.ndarray) data: Band values.
+    :param (str) data_type: CLCD, GP or others.
+    :param (tuple) criteria: Selection criteria for type others, asked interactively if not given.
+    :return: (np.ndarray) Boolean mask of forest pixels.
+    """
+    if data_type == "CLCD":
+        return data == 2
+    elif data_type == "GP":
+        # select band values not equal to 0
+        return data != 0
+    elif criteria is not None:
+        return apply_selection_criteria(data, criteria)
+    else:
+        return get_selection_criteria(data)
+
+
+def extract_class_raster(data, classes):
+    """
+    Keeps the band values of the pixels in the selected classes, to be polygonized in one pass.
+    :param (np.ndarray) data: Band values.
+    :param (list) classes: Selection criteria of each class, see ask_selection_criteria().
+    :return: (tuple) Band values in a type accepted by shapes(), and boolean mask of the selected pixels.
+    """
+    class_mask = np.zeros(data.shape, dtype=bool)
+    for criteria in classes:
+        class_mask |= apply_selection_criteria(data, criteria)
+    if data.dtype.name not in SHAPES_DTYPES:
+        data = data.astype(np.float32 if np.issubdtype(data.dtype, np.floating) else np.int32)
+    return data, class_mask
 
 
 def get_utm_zone(lon):
@@ -173,110 +932,238 @@ def get_utm_zone(lon):
 
 
 def get_resolution(data, data_type):
-    if data_type == 'CLCD':
-        lon_res_m, lat_res_m = data.res
-    else:
-        # calculate the resolution in meters
-        lon_res, lat_res = data.res
-        center_lat = (data.bounds.top + data.bounds.bottom) / 2
-        center_lon = (data.bounds.left + data.bounds.right) / 2
-        lon_res_m, lat_res_m = degrees_to_meters(center_lat, center_lon, lat_res, lon_res)
-    return lon_res_m, lat_res_m
-
-
-def reproject_in_chunk(source, destination, src_transform, src_crs, dst_transform, dst_crs,
-                       method, chunk_size=250):
-    height, width = source.shape
-    for i in range(0, height, chunk_size):
-        for j in range(0, width, chunk_size):
-            window = ((i, min(i + chunk_size, height)), (j, min(j + chunk_size, width)))
-            src_chunk = source[window[0][0]:window[0][1], window[1][0]:window[1][1]]
-
-            # skip empty chunks (if sources chunk is None or all Zeros)
-            if src_chunk is None or np.all(src_chunk == 0):
-                continue
-
-            dst_chunk = np.empty_like(src_chunk)
-            try:
-                reproject(
-                    source=src_chunk,
-                    destination=dst_chunk,
-                    srctransform=src_transform,
-                    src_crs=src_crs,
-                    dsttransform=dst_transform,
-                    dst_crs=dst_crs,
-                    resampling=method
-                )
-                destination[window[0][0]:window[0][1], window[1][0]:window[1][1]] = dst_chunk
-            except Exception as e:
-                print(f"-! Error re-projecting chunk ({i}, {j}): {e}.")
-
-
-def reproject_with_progress(source, destination, src_transform, src_crs, dst_transform, dst_crs, method):
-    # create a progress bar
-    total = source.size
-    pbar = tqdm(total=total, desc="Resampling the raster")
-
-    def update_progress(block_num, block_size, total_blocks):
-        pbar.update(block_size)
-
-    reproject(
-        source=source,
-        destination=destination,
-        src_transform=src_transform,
-        src_crs=src_crs,
-        dst_transform=dst_transform,
-        dst_crs=dst_crs,
-        resampling=method,
-        num_threads=2,
-        callback=update_progress
-    )
-    pbar.close()
+    """
+    Gets the pixel size in meters at the centre of the raster.
+    :param data: rasterio dataset.
+    :param (str) data_type: CLCD, GP or others, kept for compatibility (the CRS of the raster decides).
+    :return: (tuple) Pixel width and height in meters.
+    """
+    if data.crs is None or not data.crs.is_geographic:
+        return data.res
+    lon_res_m, lat_res_m = get_row_resolution(data)
+    centre = data.height // 2
+    return float(lon_res_m[centre]), float(lat_res_m[centre])
+
+
+def get_row_resolution(data):
+    """
+    Gets the pixel size in meters of every row of the raster, which shrinks in width towards the poles
+    in a geographic CRS.
+    :param data: rasterio dataset.
+    :return: (tuple) Arrays of pixel width and height in meters, one value per row.
+    """
+    return get_grid_row_resolution(data.transform, (data.height, data.width), data.crs)
+
+
+def get_grid_row_resolution(transform, shape, crs):
+    """
+    Gets the pixel size in meters of every row of a north-up grid, e.g. a raster clipped to a province.
+    :param (Affine) transform: Transform of the grid.
+    :param (tuple) shape: Height and width of the grid.
+    :param crs: Coordinate reference system of the grid.
+    :return: (tuple) Arrays of pixel width and height in meters, one value per row.
+    """
+    height, width = shape
+    lon_res, lat_res = abs(transform.a), abs(transform.e)
+    if crs is None or not crs.is_geographic:
+        return np.full(height, lon_res), np.full(height, lat_res)
+    row_lat = transform.f + transform.e * (np.arange(height) + 0.5)
+    center_lon = transform.c + transform.a * width / 2
+    return degrees_to_meters(row_lat, center_lon, lat_res, lon_res)
+
+
+def reproject_tiled(source, destination, src_transform, src_crs, dst_transform, dst_crs, method,
+                    tile_size=DEFAULT_REPROJECT_TILE_SIZE, num_threads=2, progress=None,
+                    src_nodata=None, dst_nodata=None, tolerance=None):
+    """
+    Reprojects the source array into the destination array tile by tile, on a thread pool.
+    Each destination tile is warped from the window of the source it covers, grown by a halo wide enough
+    for the resampling kernel. Coordinates are transformed without approximation and the kernel scale is
+    fixed for the whole destination, so the tiles add up to the same result as warping the full array at once.
+    :param (np.ndarray) source: Source band values.
+    :param (np.ndarray) destination: Destination array, filled in place.
+    :param (Affine) src_transform: Transform of the source.
+    :param src_crs: Coordinate reference system of the source.
+    :param (Affine) dst_transform: Transform of the destination.
+    :param dst_crs: Coordinate reference system of the destination, e.g. WGS84 for CLCD in Albers.
+    :param (Resampling) method: Resampling method.
+    :param (int) tile_size: Edge length of a destination tile in pixels.
+    :param (int) num_threads: Number of tiles warped at the same time.
+    :param progress: Function called with the number of finished tiles and the number of all tiles,
+        default to a progress bar.
+    :param src_nodata: Nodata value of the source.
+    :param dst_nodata: Nodata value of the destination, default to src_nodata or 0.
+    :param (float) tolerance: Error allowed when transforming coordinates, in pixels. Default to exact
+        transformation between different CRS (slower), and to the fast approximation within the same CRS,
+        where it is exact anyway.
+    """
+    height, width = destination.shape
+    windows = [Window(j, i, min(tile_size, width - j), min(tile_size, height - i))
+               for i in range(0, height, tile_size) for j in range(0, width, tile_size)]
+    dst_nodata = dst_nodata if dst_nodata is not None else (src_nodata if src_nodata is not None else 0)
+    warp_options = {
+        'resampling': method,
+        'tolerance': tolerance if tolerance is not None else get_transform_tolerance(src_crs, dst_crs),
+        'src_nodata': src_nodata,
+        'nodata': dst_nodata,
+        **get_kernel_scale(source.shape, src_transform, src_crs, destination.shape, dst_transform, dst_crs)
+    }
+
+    def warp_tile(window):
+        tile_transform = window_transform(window, dst_transform)
+        needed = get_source_window(source.shape, src_transform, src_crs, window, tile_transform, dst_crs, method)
+        if needed is None:
+            # the tile is outside the source
+            return window, np.full((window.height, window.width), dst_nodata, dtype=destination.dtype)
+        (row0, row1), (col0, col1) = needed.toranges()
+        with MemoryFile() as memfile:
+            with memfile.open(driver='GTiff', height=row1 - row0, width=col1 - col0, count=1,
+                              dtype=source.dtype, crs=src_crs, transform=window_transform(needed, src_transform),
+                              nodata=src_nodata) as chunk:
+                chunk.write(source[row0:row1, col0:col1], 1)
+            with memfile.open() as chunk, WarpedVRT(chunk, crs=dst_crs, transform=tile_transform,
+                                                   width=window.width, height=window.height,
+                                                   dtype=destination.dtype.name, **warp_options) as vrt:
+                return window, vrt.read(1)
+
+    pbar = None
+    if progress is None:
+        pbar = tqdm(total=len(windows), desc="Resampling the raster")
+
+        def progress(done, total):
+            pbar.update(1)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for done, (window, tile) in enumerate(pool.map(warp_tile, windows), start=1):
+            (row0, row1), (col0, col1) = window.toranges()
+            destination[row0:row1, col0:col1] = tile
+            progress(done, len(windows))
+    if pbar is not None:
+        pbar.close()
+
+
+def get_transform_tolerance(src_crs, dst_crs):
+    """
+    :return: (float) The error allowed when transforming coordinates between the two CRS, see reproject_tiled().
+    """
+    if CRS.from_user_input(src_crs) == CRS.from_user_input(dst_crs):
+        return DEFAULT_TRANSFORM_TOLERANCE
+    return EXACT_TRANSFORM_TOLERANCE
 
 
-def resample_data(src, data, lon_m, lat_m, transform, crs, target_resolution=None):
+def get_kernel_scale(source_shape, src_transform, src_crs, destination_shape, dst_transform, dst_crs):
+    """
+    Estimates the ratio of destination to source pixels over the whole destination. GDAL scales the resampling
+    kernel by this ratio, and would otherwise estimate it from each tile separately.
+    :return: (dict) Warp options XSCALE and YSCALE.
+    """
+    height, width = destination_shape
+    try:
+        left, bottom, right, top = transform_bounds(
+            dst_crs, src_crs, *window_bounds(Window(0, 0, width, height), dst_transform), densify_pts=21)
+        covered = from_bounds(left, bottom, right, top, transform=src_transform)
+        x_scale, y_scale = width / abs(covered.width), height / abs(covered.height)
+    except Exception:
+        x_scale, y_scale = width / source_shape[1], height / source_shape[0]
+    if not np.isfinite([x_scale, y_scale]).all():
+        x_scale, y_scale = width / source_shape[1], height / source_shape[0]
+    return {'XSCALE': x_scale, 'YSCALE': y_scale}
+
+
+def get_source_window(source_shape, src_transform, src_crs, tile, tile_transform, dst_crs, method):
+    """
+    Finds the window of the source needed to warp a destination tile, including a halo for the
+    resampling kernel.
+    :param (tuple) source_shape: Shape of the source array.
+    :param (Affine) src_transform: Transform of the source.
+    :param src_crs: Coordinate reference system of the source.
+    :param (Window) tile: The destination tile.
+    :param (Affine) tile_transform: Transform of the destination tile.
+    :param dst_crs: Coordinate reference system of the destination.
+    :param (Resampling) method: Resampling method.
+    :return: (Window) Window of the source, None if the tile does not overlap the source.
+    """
+    source_window = Window(0, 0, source_shape[1], source_shape[0])
+    tile_bounds = window_bounds(Window(0, 0, tile.width, tile.height), tile_transform)
+    try:
+        needed = from_bounds(*transform_bounds(dst_crs, src_crs, *tile_bounds, densify_pts=21),
+                             transform=src_transform)
+    except Exception:
+        # the tile cannot be projected onto the source, so fall back to the full source
+        return source_window
+    if not np.isfinite([needed.col_off, needed.row_off, needed.width, needed.height]).all():
+        return source_window
+    scale = max(needed.width / tile.width, needed.height / tile.height, 1)
+    halo = int(np.ceil(RESAMPLING_RADIUS.get(method, 1) * scale)) + 1
+    needed = Window(needed.col_off - halo, needed.row_off - halo, needed.width + 2 * halo,
+                    needed.height + 2 * halo).round_offsets(op='floor').round_lengths(op='ceil')
+    try:
+        return needed.intersection(source_window)
+    except WindowError:
+        return None
+
+
+def reproject_to_crs(data, transform, src_crs, dst_crs, method=Resampling.nearest, resolution=None,
+                     tile_size=DEFAULT_REPROJECT_TILE_SIZE, num_threads=2, progress=None,
+                     src_nodata=None, dst_nodata=None, tolerance=None):
+    """
+    Reprojects an array into another coordinate reference system, on the default grid computed by GDAL.
+    :param (np.ndarray) data: Band values.
+    :param (Affine) transform: Transform of the data.
+    :param src_crs: Coordinate reference system of the data.
+    :param dst_crs: Target coordinate reference system.
+    :param (Resampling) method: Resampling method.
+    :param resolution: Target resolution in units of dst_crs, default to the one estimated by GDAL.
+    See reproject_tiled() for the other parameters.
+    :return: (tuple) Reprojected array and its transform.
+    """
+    height, width = data.shape
+    left, top = transform * (0, 0)
+    right, bottom = transform * (width, height)
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, dst_crs, width, height, left=min(left, right), bottom=min(top, bottom),
+        right=max(left, right), top=max(top, bottom), resolution=resolution)
+    destination = np.empty((dst_height, dst_width), dtype=data.dtype)
+    reproject_tiled(data, destination, transform, src_crs, dst_transform, dst_crs, method,
+                    tile_size=tile_size, num_threads=num_threads, progress=progress,
+                    src_nodata=src_nodata, dst_nodata=dst_nodata, tolerance=tolerance)
+    return destination, dst_transform
+
+
+def resample_data(src, data, lon_m, lat_m, transform, crs, target_resolution=None, tail='pad'):
     try:
         if target_resolution:
             print(">> Getting ready for resampling...")
-            # calculate new dimensions
-            new_width = int((data.shape[1] * lon_m) / target_resolution)
-            new_height = int((data.shape[0] * lat_m) / target_resolution)
+            lon_m, lat_m = get_data_resolution(transform, data.shape, crs, lon_m, lat_m)
             # calculate new transform
             scale_x = target_resolution / lon_m
             scale_y = target_resolution / lat_m
-            new_transform = src.transform * src.transform.scale(scale_x, scale_y)
+            factor = get_resample_factor(lon_m, lat_m, target_resolution)
+            if factor is not None:
+                # --> whole pixels merge into each new pixel, so the maximum is taken block by block
+                factor_x, factor_y = factor
+                print(f">> Resampling the raster by {factor_x} x {factor_y} blocks...")
+                data = block_max_downsample(data, factor_x, factor_y, tail=tail)
+                new_transform = transform * Affine.scale(factor_x, factor_y)
+                print(">> Resample finished.")
+                return data, new_transform
+            # calculate new dimensions
+            new_width = int((data.shape[1] * lon_m) / target_resolution)
+            new_height = int((data.shape[0] * lat_m) / target_resolution)
+            new_transform = transform * Affine.scale(scale_x, scale_y)
             # create a new array for the resampled data
             resampled_data = np.empty((new_height, new_width), dtype=data.dtype)
 
             # resample data to the target resolution
             print(">> Resampling the raster...")
-            # reproject_with_progress(
-            #     source=data,
-            #     destination=resampled_data,
-            #     src_transform=transform,
-            #     src_crs=crs,
-            #     dst_transform=new_transform,
-            #     dst_crs=crs,
-            #     method=Resampling.mode
-            # )
-            # reproject_in_chunk(
-            #     source=data,
-            #     destination=resampled_data,
-            #     src_transform=transform,
-            #     src_crs=crs,
-            #     dst_transform=new_transform,
-            #     dst_crs=crs,
-            #     method=Resampling.mode,
-            #     chunk_size=250*20
-            # )
-            reproject(
+            reproject_tiled(
                 source=data,
                 destination=resampled_data,
                 src_transform=transform,
                 src_crs=crs,
                 dst_transform=new_transform,
                 dst_crs=crs,
-                resampling=Resampling.max  # valid if contains any pixel of plantation
+                method=Resampling.max  # valid if contains any pixel of plantation
             )
             data = resampled_data
             print(">> Resample finished.")
@@ -289,6 +1176,90 @@ def resample_data(src, data, lon_m, lat_m, transform, crs, target_resolution=Non
         print(f"An unexpected error occurred while resampling the data: {e}.")
 
 
+def get_data_resolution(transform, shape, crs, lon_m, lat_m):
+    """
+    Gets the pixel size in meters of a grid to resample.
+    :param (Affine) transform: Transform of the grid.
+    :param (tuple) shape: Height and width of the grid.
+    :param crs: Coordinate reference system of the grid.
+    :param (float) lon_m: Pixel width in meters of the whole raster.
+    :param (float) lat_m: Pixel height in meters of the whole raster.
+    :return: (tuple) Pixel width and height in meters.
+    """
+    if crs is None or not crs.is_geographic:
+        return lon_m, lat_m
+    # the pixel size of the whole raster is taken at its centre, which can be far from the rows
+    # resampled here (e.g. a province), so the scale follows the centre row of the grid instead
+    row_lon_m, row_lat_m = get_grid_row_resolution(transform, shape, crs)
+    centre = shape[0] // 2
+    lon_m, lat_m = float(row_lon_m[centre]), float(row_lat_m[centre])
+    print(f"-- Resolution of the data: {lon_m:.2f} meters x {lat_m:.2f} meters "
+          f"(width {row_lon_m.min():.2f} to {row_lon_m.max():.2f} meters over the rows).")
+    return lon_m, lat_m
+
+
+def get_resample_factor(lon_m, lat_m, target_resolution):
+    """
+    :return: (tuple) Numbers of columns and rows merged into a new pixel, None if the target resolution
+        is not a whole number of pixels.
+    """
+    factor_x = get_integer_factor(target_resolution / lon_m)
+    factor_y = get_integer_factor(target_resolution / lat_m)
+    if factor_x is None or factor_y is None:
+        return None
+    return factor_x, factor_y
+
+
+def get_integer_factor(scale, tolerance=1e-6):
+    """
+    Checks if a resampling scale is a whole number of pixels.
+    :param (float) scale: Ratio of the target resolution to the current resolution.
+    :param (float) tolerance: Allowed difference from the nearest integer.
+    :return: (int) The integer factor, None if the scale is not an integer above 1.
+    """
+    factor = round(scale)
+    if factor >= 1 and abs(scale - factor) <= tolerance * max(1.0, scale):
+        return int(factor)
+    return None
+
+
+def block_max_downsample(data, factor_x, factor_y, tail='pad', chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Downsamples the array by integer factors, taking the maximum of every block of factor_y x factor_x pixels.
+    The array is processed in chunks of rows, so the temporary memory depends on the chunk size.
+    :param (np.ndarray) data: Band values.
+    :param (int) factor_x: Number of columns merged into a new pixel.
+    :param (int) factor_y: Number of rows merged into a new pixel.
+    :param (str) tail: Rule for edges not divided evenly by the factors: 'pad' takes the maximum of the
+        remaining pixels as a partial block, 'drop' leaves them out, as reproject() does with the truncated size.
+    :param (int) chunk_rows: Number of output rows computed at a time.
+    :return: (np.ndarray) Downsampled array.
+    """
+    if tail not in ('pad', 'drop'):
+        raise ValueError(f"Unknown tail rule {tail}, please use 'pad' or 'drop'.")
+    height, width = data.shape
+    full_rows, full_cols = height // factor_y, width // factor_x
+    if tail == 'pad':
+        out_rows, out_cols = -(-height // factor_y), -(-width // factor_x)
+    else:
+        out_rows, out_cols = full_rows, full_cols
+    out = np.empty((out_rows, out_cols), dtype=data.dtype)
+
+    def reduce_columns(row_max, rows):
+        # row_max holds the maximum over the rows of each block, for all columns
+        out[rows, :full_cols] = row_max[:, :full_cols * factor_x].reshape(-1, full_cols, factor_x).max(axis=2)
+        if out_cols > full_cols:
+            out[rows, full_cols] = row_max[:, full_cols * factor_x:].max(axis=1)
+
+    for i in range(0, full_rows, chunk_rows):
+        n = min(chunk_rows, full_rows - i)
+        block_rows = data[i * factor_y:(i + n) * factor_y]
+        reduce_columns(block_rows.reshape(n, factor_y, width).max(axis=1), slice(i, i + n))
+    if out_rows > full_rows:
+        reduce_columns(data[full_rows * factor_y:].max(axis=0, keepdims=True), slice(full_rows, full_rows + 1))
+    return out
+
+
 def whether_to_clip():
     clip_choice = input("-- Perform shapefile creation over mask? (yes / no): ").strip().lower()
     if clip_choice == "yes":
@@ -298,9 +1269,90 @@ def whether_to_clip():
         return path_for_mask, path_for_export, prefix_for_export
     elif clip_choice == "no":
         path_for_mask = None
-        path_for_export = input("-- Path to the export file (ends with .shp): ")
+        path_for_export = input("-- Path to the export file (ends with .shp, .gpkg or .fgb): ")
         prefix_for_export = None
         return path_for_mask, path_for_export, prefix_for_export
     else:
         print("!! Invalid input. Please enter letter yes or no.")
         return whether_to_clip()
+
+
+def whether_to_tile():
+    tile_choice = input("-- Process the raster in tiles to limit memory use? (yes / no): ").strip().lower()
+    if tile_choice == "yes":
+        tile_size = input(f"-- Tile size in pixels (press Enter for {DEFAULT_TILE_SIZE}): ").strip()
+        return int(tile_size) if tile_size else DEFAULT_TILE_SIZE
+    elif tile_choice == "no":
+        return None
+    else:
+        print("!! Invalid input. Please enter letter yes or no.")
+        return whether_to_tile()
+
+
+def get_parallel_info():
+    workers = input("-- Number of worker processes for clipping (press Enter to run one area at a time): ").strip()
+    if not workers:
+        print(">> Clipping areas one at a time.")
+        return None, None
+    memory = input("-- Memory limit per worker in MB (press Enter for no limit): ").strip()
+    return int(workers), float(memory) if memory else None
+
+
+def get_export_format():
+    export_format = input("-- Format of export files (shp / gpkg / fgb, press Enter for shp): ").strip().lower()
+    if not export_format:
+        return 'shp'
+    elif export_format in VECTOR_DRIVERS:
+        return export_format
+    else:
+        print("!! Invalid input. Please enter shp, gpkg or fgb.")
+        return get_export_format()
+
+
+def get_class_info():
+    class_choice = input("-- Polygonize several classes in one pass, keeping their band values? (yes / no): ")
+    class_choice = class_choice.strip().lower()
+    if class_choice == "yes":
+        classes = ask_class_criteria()
+        layout = input("-- Export one file per class or one combined file? (separate / combined): ").strip().lower()
+        split_classes = layout == "separate"
+        print(f">> {len(classes)} classes selected, exported to {'separate files' if split_classes else 'one file'}.")
+        return classes, split_classes
+    elif class_choice == "no":
+        return None, False
+    else:
+        print("!! Invalid input. Please enter letter yes or no.")
+        return get_class_info()
+
+
+def ask_class_criteria():
+    """
+    Asks for the band values or ranges of several classes at once.
+    :return: (list) Selection criteria of each class, in the form of ask_selection_criteria().
+    """
+    text = input("-- Band values or ranges of the classes, separated by commas (e.g. 2,3,4-5): ")
+    try:
+        return parse_class_criteria(text)
+    except ValueError:
+        print("!! Invalid input. Please enter numbers such as 2 or ranges such as 4-5.")
+        return ask_class_criteria()
+
+
+def parse_class_criteria(text):
+    """
+    Parses classes such as "2,3,4-5" into selection criteria.
+    :param (str) text: Band values or ranges separated by commas.
+    :return: (list) ('value', value) or ('range', min_val, max_val) for each class.
+    """
+    classes = []
+    for item in text.split(','):
+        item = item.strip()
+        # the separator of a range is a dash after the first character, which may be a minus sign
+        dash = item.find('-', 1)
+        if dash > 0:
+            classes.append(('range', float(item[:dash]), float(item[dash + 1:])))
+        else:
+            classes.append(('value', int(item)))
+    if not classes:
+        raise ValueError("No class given.")
+    return classes
@@ -0,0 +1,362 @@
+# Extract the time series of vegetation indices over mangrove polygons from Landsat 7 scenes on disk
+#
+# Usage: python local_vi_extraction.py scenes_folder polygons.shp output_folder
+#            [--start 1999-01-01] [--end 2023-12-31] [--vi ndvi nirv] [--no-brdf] [--workers 8] [--memory 4000]
+#            [--cache label_folder] [--no-index]
+#
+# The same chain as preprocess_collection() in ee_tools.py, without Earth Engine: the cloud and cloud shadow
+# bits of QA_PIXEL mask the pixels, the bands are scaled to reflectance, corrected for BRDF (brdf_local.py),
+# and the mean of each index is taken over the pixels of each polygon. The scenes are Collection-2 Level-2
+# products as downloaded from USGS, one GeoTIFF per band (e.g. LE07_L2SP_122044_20010615_20200917_02_T1_SR_B3.TIF)
+# with the MTL file giving the acquisition time, in any sub-folder of scenes_folder.
+#
+# Each scene is processed in a worker process and written to its own table, in the format of the exports of
+# MangroveStability.py read by arrange_ee_tables.py: Mean_{indices}_{scene}.csv with columns system:index
+# ({polygon}_{sensor}_{path/row}_{date}), one column per index (or target for a single index), lat and lon.
+# The polygon is the index label of the feature in the polygon layer. Tables that already exist are skipped.
+# Pixels are taken in a polygon when their centre is, where Earth Engine also weighs the pixels cut by
+# the boundary, so the means of small polygons may differ slightly.
+#
+# The polygons are rasterized once per scene grid into label rasters kept in the cache folder
+# (polygon_label_index.py, default to label_index in the output folder), and the means of all polygons of
+# a scene are taken in one pass. With --no-index, each polygon is read and averaged in its own window.
+
+import os
+import re
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.windows import transform as window_transform
+from shapely.geometry import box
+from tqdm import tqdm
+from brdf_local import BANDS, get_c_factor, get_scene_geometry
+from get_forest_tools import get_worker_count, limit_worker_memory
+from polygon_label_index import get_polygon_fingerprint, get_zonal_means, load_label_index
+
+# files of the bands used by the indices, and of the QA band, for each sensor
+BAND_FILES_BY_SENSOR = {
+    'LE07': {'red': 'SR_B3', 'nir': 'SR_B4', 'QA_PIXEL': 'QA_PIXEL'}
+}
+# bits of QA_PIXEL, as in ee_tools.mask_landsat7_sr(); fill pixels are masked in the Earth Engine assets
+FILL_BIT_MASK = (1 << 0)
+CLOUD_SHADOW_BIT_MASK = (1 << 3)
+CLOUD_BIT_MASK = (1 << 5)
+# scale and offset of the surface reflectance, as in ee_tools.apply_scaling_offset(); 0 is no data
+SR_SCALE = 2.75e-05
+SR_OFFSET = -0.2
+SR_NODATA = 0
+
+# polygons of the run, loaded once into each worker, and their projections by CRS of the scenes
+_polygons = {}
+
+
+def get_ndvi(red, nir):
+    return (nir - red) / (nir + red)
+
+
+def get_nirv(red, nir):
+    return (nir - red) / (nir + red) * nir
+
+
+# functions calculating each vegetation index from the red and near-infrared reflectance
+VI_FUNCTIONS = {
+    'ndvi': get_ndvi,
+    'nirv': get_nirv
+}
+
+
+def find_scenes(path_to_scenes, start_date=None, end_date=None):
+    """
+    Finds the Level-2 scenes in a folder, with the files of their bands.
+    :param (str) path_to_scenes: Folder of the scenes, searched with its sub-folders.
+    :param (str) start_date: First date of the scenes, in format 'YYYY-MM-dd', None for no limit.
+    :param (str) end_date: End date of the scenes (excluded, as ee.ImageCollection.filterDate()), None for no limit.
+    :return: (list) Scenes as dictionaries with product ID, system:index, band files and MTL file.
+    """
+    scenes = []
+    qa_files = glob.glob(os.path.join(path_to_scenes, '**', '*_QA_PIXEL.[Tt][Ii][Ff]'), recursive=True)
+    for qa_file in sorted(qa_files):
+        prefix, extension = os.path.splitext(qa_file)
+        prefix = prefix[:-len('_QA_PIXEL')]
+        product_id = os.path.basename(prefix)
+        sensor, _, path_row, date = product_id.split('_')[:4]
+        if sensor not in BAND_FILES_BY_SENSOR:
+            print(f"-! Scene {product_id} skipped, sensor {sensor} is not supported.")
+            continue
+        if (start_date and date < start_date.replace('-', '')) or (end_date and date >= end_date.replace('-', '')):
+            continue
+        files = {band: f"{prefix}_{suffix}{extension}" for band, suffix in BAND_FILES_BY_SENSOR[sensor].items()}
+        missing = [path for path in files.values() if not os.path.exists(path)]
+        if missing:
+            print(f"-! Scene {product_id} skipped, missing {', '.join(os.path.basename(m) for m in missing)}.")
+            continue
+        mtl_file = f"{prefix}_MTL.txt"
+        scenes.append({
+            'product_id': product_id,
+            # as the system:index of the scene in the Landsat collections of Earth Engine
+            'system_index': f"{sensor}_{path_row}_{date}",
+            'files': files,
+            'mtl': mtl_file if os.path.exists(mtl_file) else None
+        })
+    print(f">> {len(scenes)} scenes found.")
+    return scenes
+
+
+def read_acquisition_time(path_to_mtl):
+    """
+    Reads the acquisition time of a scene from its MTL file.
+    :param (str) path_to_mtl: Path to the MTL file in text.
+    :return: (datetime) Acquisition time in UTC.
+    """
+    with open(path_to_mtl) as f:
+        metadata = dict(re.findall(r'^\s*(DATE_ACQUIRED|SCENE_CENTER_TIME)\s*=\s*"?([^"\n]+)"?', f.read(), re.M))
+    # the centre time has seven decimals of seconds, more than datetime reads
+    time_of_day = metadata['SCENE_CENTER_TIME'].rstrip('Z').split('.')[0]
+    return datetime.strptime(f"{metadata['DATE_ACQUIRED']} {time_of_day}", '%Y-%m-%d %H:%M:%S')
+
+
+def load_polygons(path_to_polygons):
+    """
+    Loads the polygons with the location of their centroids, as marked in the exports of Earth Engine.
+    :param (str) path_to_polygons: Path to the polygon layer.
+    :return: geopandas.GeoDataFrame in EPSG:4326 with columns lon and lat.
+    """
+    polygons = gpd.read_file(path_to_polygons).to_crs("epsg:4326")
+    # in degrees, as ee.Geometry.centroid() in EPSG:4326
+    centroids = shapely.centroid(np.asarray(polygons.geometry.values))
+    return gpd.GeoDataFrame({'lon': shapely.get_x(centroids), 'lat': shapely.get_y(centroids)},
+                            geometry=polygons.geometry, index=polygons.index, crs=polygons.crs)
+
+
+def init_extraction_worker(polygons, memory_per_worker, fingerprint=None):
+    """
+    Initializer of worker processes, keeping the polygons for all scenes of the worker.
+    :param polygons: geopandas.GeoDataFrame from load_polygons().
+    :param (float) memory_per_worker: Memory limit in MB, None for no limit.
+    :param (str) fingerprint: Fingerprint of the polygons for the label rasters, computed here if not given.
+    """
+    _polygons['all'] = polygons
+    _polygons['by_crs'] = {}
+    _polygons['fingerprint'] = fingerprint or get_polygon_fingerprint(polygons)
+    limit_worker_memory(memory_per_worker)
+
+
+def get_projected_polygons(src):
+    """
+    :return: geopandas.GeoDataFrame of all polygons in the CRS of the scene.
+    """
+    crs_key = src.crs.to_wkt()
+    if crs_key not in _polygons['by_crs']:
+        # scenes of the same UTM zone share the projected polygons
+        _polygons['by_crs'][crs_key] = _polygons['all'].to_crs(src.crs)
+    return _polygons['by_crs'][crs_key]
+
+
+def get_scene_polygons(src):
+    """
+    Selects the polygons within the bounds of a scene, in the CRS of the scene.
+    :param src: rasterio dataset of the scene.
+    :return: (tuple) Positions of the polygons in the layer, and geopandas.GeoDataFrame of them with columns
+        lon and lat.
+    """
+    projected = get_projected_polygons(src)
+    positions = np.sort(projected.sindex.query(box(*src.bounds)))
+    return positions, projected.iloc[positions]
+
+
+def extract_scene(scene, vi_list, brdf=True, path_to_cache=None):
+    """
+    Calculates the mean of each index over each polygon within the scene.
+    :param (dict) scene: Scene from find_scenes().
+    :param (list) vi_list: Vegetation indices to calculate, see VI_FUNCTIONS.
+    :param (bool) brdf: Whether to correct the reflectance for BRDF, which needs the MTL file of the scene.
+    :param (str) path_to_cache: Folder of the label rasters, None to average each polygon in its own window.
+    :return: pandas.DataFrame with the rows of the scene, NaN for polygons without clear pixels.
+    """
+    with ExitStack() as stack:
+        sources = {band: stack.enter_context(rasterio.open(path)) for band, path in scene['files'].items()}
+        correction = None
+        if brdf:
+            if scene['mtl'] is None:
+                raise ValueError(f"MTL file of {scene['product_id']} not found, needed for the BRDF correction.")
+            correction = get_scene_geometry(sources['QA_PIXEL'], read_acquisition_time(scene['mtl']))
+        positions, polygons = get_scene_polygons(sources['QA_PIXEL'])
+        if path_to_cache is not None:
+            means = get_means_by_index(sources, vi_list, correction, path_to_cache)
+            values = {vi: means[vi][positions] for vi in vi_list}
+        else:
+            values = get_means_by_window(sources, polygons, vi_list, correction)
+
+    table = pd.DataFrame({
+        'system:index': [f"{label}_{scene['system_index']}" for label in polygons.index],
+        **values,
+        'lat': polygons['lat'].to_numpy(),
+        'lon': polygons['lon'].to_numpy()
+    })
+    if len(vi_list) == 1:
+        table = table.rename(columns={vi_list[0]: 'target'})
+    return table
+
+
+def read_clear_reflectance(sources, window, inside, correction):
+    """
+    Reads the red and near-infrared reflectance of the clear pixels in a window.
+    :param (dict) sources: rasterio datasets of the bands of the scene.
+    :param (Window) window: Window of the scene.
+    :param (np.ndarray) inside: Pixels of the window to read.
+    :param (tuple) correction: Scene geometry from brdf_local.get_scene_geometry(), None to skip the correction.
+    :return: (tuple) Mask of the clear pixels, and the red and near-infrared reflectance of the clear pixels.
+    """
+    qa = sources['QA_PIXEL'].read(1, window=window)
+    red = sources['red'].read(1, window=window)
+    nir = sources['nir'].read(1, window=window)
+    clear = inside & (qa & (FILL_BIT_MASK | CLOUD_SHADOW_BIT_MASK | CLOUD_BIT_MASK) == 0) \
+        & (red != SR_NODATA) & (nir != SR_NODATA)
+    red = red[clear] * SR_SCALE + SR_OFFSET
+    nir = nir[clear] * SR_SCALE + SR_OFFSET
+    if correction is not None and len(red):
+        scene_constants, corners_xy, to_lonlat = correction
+        # the c-factor of the clear pixels only
+        rows, cols = np.nonzero(clear)
+        x, y = window_transform(window, sources['QA_PIXEL'].transform) * (cols + 0.5, rows + 0.5)
+        lon, lat = to_lonlat.transform(x, y)
+        c_factor = get_c_factor(lon, lat, x, y, scene_constants, corners_xy)
+        red = red * c_factor[BANDS.index('red')]
+        nir = nir * c_factor[BANDS.index('nir')]
+    return clear, red, nir
+
+
+def get_vi_values(red, nir, vi_list):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {vi: VI_FUNCTIONS[vi](red, nir) for vi in vi_list}
+
+
+def get_means_by_index(sources, vi_list, correction, path_to_cache):
+    """
+    Averages the indices over all polygons at once, with the label raster of the scene grid.
+    :return: (dict) Means of each index, arrays indexed by the position of the polygon in the layer.
+    """
+    qa_src = sources['QA_PIXEL']
+    num_polygons = len(_polygons['all'])
+    labels, window = load_label_index(qa_src, get_projected_polygons(qa_src), _polygons['fingerprint'],
+                                      path_to_cache)
+    if labels is None:
+        return {vi: np.full(num_polygons, np.nan) for vi in vi_list}
+    labels = np.asarray(labels)
+    clear, red, nir = read_clear_reflectance(sources, window, labels > 0, correction)
+    return get_zonal_means(labels[clear], get_vi_values(red, nir, vi_list), num_polygons)
+
+
+def get_means_by_window(sources, polygons, vi_list, correction):
+    """
+    Averages the indices over each polygon in its own window of the scene.
+    :return: (dict) Means of each index, arrays in the order of the polygons.
+    """
+    qa_src = sources['QA_PIXEL']
+    values = {vi: np.full(len(polygons), np.nan) for vi in vi_list}
+    for i, geometry in enumerate(polygons.geometry):
+        try:
+            window = geometry_window(qa_src, [geometry])
+        except WindowError:
+            continue
+        inside = geometry_mask([geometry], out_shape=(window.height, window.width),
+                               transform=window_transform(window, qa_src.transform), invert=True)
+        clear, red, nir = read_clear_reflectance(sources, window, inside, correction)
+        for vi, pixel_values in get_vi_values(red, nir, vi_list).items():
+            pixel_values = pixel_values[np.isfinite(pixel_values)]
+            if len(pixel_values):
+                values[vi][i] = pixel_values.mean()
+    return values
+
+
+def get_scene_table_path(path_to_export, scene, vi_list):
+    # dashes in the scene name keep the file ID of arrange_ee_tables.py in one piece
+    return os.path.join(path_to_export, f"Mean_{'-'.join(vi_list)}_{scene['system_index'].replace('_', '-')}.csv")
+
+
+def run_scene_job(scene, vi_list, brdf, path_to_export, path_to_cache):
+    """
+    Writes the table of one scene, to a temporary name first.
+    :return: (int) Number of rows written.
+    """
+    path_to_table = get_scene_table_path(path_to_export, scene, vi_list)
+    table = extract_scene(scene, vi_list, brdf, path_to_cache)
+    table.to_csv(f"{path_to_table}.partial", index=False)
+    os.replace(f"{path_to_table}.partial", path_to_table)
+    return len(table)
+
+
+def extract_scenes_in_parallel(scenes, polygons, path_to_export, vi_list, brdf=True, num_workers=None,
+                               memory_per_worker=None, path_to_cache=None):
+    """
+    Processes every scene as a separate job in a process pool, skipping tables that already exist.
+    :param (list) scenes: Scenes from find_scenes().
+    :param polygons: geopandas.GeoDataFrame from load_polygons().
+    :param (str) path_to_export: Folder of the tables.
+    :param (list) vi_list: Vegetation indices to calculate, see VI_FUNCTIONS.
+    :param (bool) brdf: Whether to correct the reflectance for BRDF.
+    :param (int) num_workers: Number of worker processes, default to the number of CPUs.
+    :param (float) memory_per_worker: Memory limit of each worker in MB, None for no limit.
+    :param (str) path_to_cache: Folder of the label rasters, None to average each polygon in its own window.
+    :return: (dict) Number of rows written for each scene, None for failed ones.
+    """
+    os.makedirs(path_to_export, exist_ok=True)
+    pending = [scene for scene in scenes if not os.path.exists(get_scene_table_path(path_to_export, scene, vi_list))]
+    print(f">> {len(scenes) - len(pending)} of {len(scenes)} scenes already extracted.")
+    if not pending:
+        return {}
+    num_workers = get_worker_count(num_workers, memory_per_worker)
+    print(f">> Extracting {len(pending)} scenes with {num_workers} worker processes.")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_extraction_worker,
+                             initargs=(polygons, memory_per_worker, get_polygon_fingerprint(polygons))) as pool:
+        futures = {pool.submit(run_scene_job, scene, vi_list, brdf, path_to_export, path_to_cache):
+                   scene['product_id']
+                   for scene in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting scenes"):
+            product_id = futures[future]
+            try:
+                results[product_id] = future.result()
+            except Exception as e:
+                print(f"-! Error extracting {product_id}: {e}.")
+                results[product_id] = None
+    failed = [product_id for product_id, count in results.items() if count is None]
+    if failed:
+        print(f"-! {len(failed)} scenes failed, run again to retry them.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract vegetation indices over polygons from Landsat 7 scenes.")
+    parser.add_argument('scenes', help="folder of the Level-2 scenes")
+    parser.add_argument('polygons', help="polygon layer, e.g. ChinaMangrove2020.shp")
+    parser.add_argument('output', help="folder of the tables")
+    parser.add_argument('--start', default='1999-01-01', help="first date, YYYY-MM-dd")
+    parser.add_argument('--end', default='2023-12-31', help="end date (excluded), YYYY-MM-dd")
+    parser.add_argument('--vi', nargs='+', default=['ndvi', 'nirv'], choices=list(VI_FUNCTIONS))
+    parser.add_argument('--no-brdf', action='store_true', help="skip the BRDF correction")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--memory', type=float, default=None, help="memory limit of each worker in MB")
+    parser.add_argument('--cache', default=None, help="folder of the label rasters, default to output/label_index")
+    parser.add_argument('--no-index', action='store_true', help="average each polygon in its own window")
+    args = parser.parse_args()
+
+    found_scenes = find_scenes(args.scenes, args.start, args.end)
+    if not found_scenes:
+        sys.exit(0)
+    label_cache = None if args.no_index else (args.cache or os.path.join(args.output, 'label_index'))
+    extract_scenes_in_parallel(found_scenes, load_polygons(args.polygons), args.output, args.vi,
+                               brdf=not args.no_brdf, num_workers=args.workers, memory_per_worker=args.memory,
+                               path_to_cache=label_cache)
+    print(f">> The tables have been saved to {args.output}.")
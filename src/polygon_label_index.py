@@ -0,0 +1,151 @@
+# Label rasters of the polygons on the grids of Landsat scenes, kept on disk for repeated zonal means
+#
+# Every scene of a WRS-2 path/row covers the same polygons on about the same pixel grid, so the polygons are
+# rasterized once per grid into a label raster (the position of the polygon in the layer plus one, 0 outside),
+# saved as .npy in the cache folder and memory-mapped by the next scenes of the grid. The means of all polygons
+# in a scene are then a weighted np.bincount() over the labelled pixels.
+#
+# The label raster covers the bounds of the scene snapped to blocks of INDEX_BLOCK_SIZE pixels, so scenes of
+# a path/row with slightly different extents share it, cut to the pixels of the polygons. Its name is a hash
+# of the grid and of the content of the polygon layer, so an edited layer builds new label rasters; old ones
+# can be deleted from the cache folder at any time. Polygons are expected not to overlap: where they do,
+# the pixel goes to the last one.
+
+import os
+import json
+import math
+import hashlib
+import numpy as np
+import shapely
+from rasterio.features import rasterize
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from shapely.geometry import box
+
+# the bounds of a scene are snapped outwards to blocks of this size in pixels
+INDEX_BLOCK_SIZE = 500
+
+
+def get_polygon_fingerprint(polygons):
+    """
+    Hashes the geometries of the polygon layer and their order, which the labels depend on.
+    :param polygons: geopandas.GeoDataFrame.
+    :return: (str) Hex digest.
+    """
+    digest = hashlib.sha1(polygons.crs.to_wkt().encode('utf-8'))
+    for wkb in shapely.to_wkb(np.asarray(polygons.geometry.values)):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def get_index_region(src):
+    """
+    Snaps the bounds of a scene outwards to blocks on its pixel grid.
+    :param src: rasterio dataset of the scene, north up.
+    :return: (tuple) Bounds (left, bottom, right, top) of the region, and the pixel size.
+    """
+    res = src.transform.a
+    left, bottom, right, top = src.bounds
+    # offset of the pixel grid, the same for all scenes on it
+    grid_x, grid_y = src.transform.c % res, src.transform.f % res
+    block = INDEX_BLOCK_SIZE * res
+    return (grid_x + math.floor((left - grid_x) / block) * block,
+            grid_y + math.floor((bottom - grid_y) / block) * block,
+            grid_x + math.ceil((right - grid_x) / block) * block,
+            grid_y + math.ceil((top - grid_y) / block) * block), res
+
+
+def load_label_index(src, projected_polygons, fingerprint, path_to_cache):
+    """
+    Loads the label raster of the grid of a scene, building it first if the cache does not hold it.
+    :param src: rasterio dataset of the scene, north up.
+    :param projected_polygons: geopandas.GeoDataFrame of the whole polygon layer in the CRS of the scene.
+    :param (str) fingerprint: Fingerprint of the polygon layer, from get_polygon_fingerprint().
+    :param (str) path_to_cache: Folder of the label rasters.
+    :return: (tuple) Labels over the window of the scene they cover (memory-mapped), and that window of the
+        scene, or (None, None) if no polygon falls in the scene.
+    """
+    region, res = get_index_region(src)
+    key = hashlib.sha1(json.dumps({
+        'crs': src.crs.to_wkt(),
+        'res': res,
+        'region': region,
+        'polygons': fingerprint
+    }).encode('utf-8')).hexdigest()[:16]
+    path_to_labels = os.path.join(path_to_cache, f"labels_{key}.npy")
+    path_to_info = os.path.join(path_to_cache, f"labels_{key}.json")
+    if not os.path.exists(path_to_info):
+        build_label_index(projected_polygons, region, res, path_to_labels, path_to_info)
+    with open(path_to_info) as f:
+        info = json.load(f)
+    if info['transform'] is None:
+        return None, None
+
+    # the label raster and the scene share the pixel grid, so the offset is a whole number of pixels
+    index_transform = Affine(*info['transform'])
+    height, width = info['shape']
+    col_off = round((index_transform.c - src.transform.c) / res)
+    row_off = round((src.transform.f - index_transform.f) / res)
+    col_start, row_start = max(col_off, 0), max(row_off, 0)
+    col_stop, row_stop = min(col_off + width, src.width), min(row_off + height, src.height)
+    if col_start >= col_stop or row_start >= row_stop:
+        return None, None
+    labels = np.load(path_to_labels, mmap_mode='r')
+    return labels[row_start - row_off:row_stop - row_off, col_start - col_off:col_stop - col_off], \
+        Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def build_label_index(projected_polygons, region, res, path_to_labels, path_to_info):
+    """
+    Rasterizes the polygons in the region onto the pixel grid, over the bounds of the polygons only.
+    Files are written under temporary names first, so workers building the same index at the same time
+    do not read a partial one.
+    :param projected_polygons: geopandas.GeoDataFrame of the whole polygon layer in the CRS of the grid.
+    :param (tuple) region: Bounds of the region from get_index_region().
+    :param (float) res: Pixel size.
+    :param (str) path_to_labels: Path to the label raster in .npy.
+    :param (str) path_to_info: Path to the description of the label raster in JSON, written last.
+    """
+    os.makedirs(os.path.dirname(path_to_info) or '.', exist_ok=True)
+    left, bottom, right, top = region
+    positions = projected_polygons.sindex.query(box(*region))
+    info = {'transform': None, 'shape': None, 'polygons': int(len(positions))}
+    if len(positions):
+        geometries = projected_polygons.geometry.values[positions]
+        bounds = shapely.total_bounds(np.asarray(geometries))
+        # snap the bounds of the polygons to the pixel grid of the region, within the region
+        col0 = max(0, math.floor((bounds[0] - left) / res))
+        col1 = min(round((right - left) / res), math.ceil((bounds[2] - left) / res))
+        row0 = max(0, math.floor((top - bounds[3]) / res))
+        row1 = min(round((top - bottom) / res), math.ceil((top - bounds[1]) / res))
+        transform = Affine(res, 0, left + col0 * res, 0, -res, top - row0 * res)
+        temporary_labels = f"{path_to_labels}.{os.getpid()}.tmp.npy"
+        labels = np.lib.format.open_memmap(temporary_labels, mode='w+', dtype=np.int32,
+                                           shape=(row1 - row0, col1 - col0))
+        rasterize(zip(geometries, positions.astype(np.int64) + 1), out=labels, transform=transform)
+        labels.flush()
+        del labels
+        os.replace(temporary_labels, path_to_labels)
+        info.update(transform=list(transform)[:6], shape=[row1 - row0, col1 - col0])
+    temporary_info = f"{path_to_info}.{os.getpid()}.tmp"
+    with open(temporary_info, 'w') as f:
+        json.dump(info, f)
+    os.replace(temporary_info, path_to_info)
+
+
+def get_zonal_means(labels, values, num_polygons):
+    """
+    Calculates the mean of each polygon in one pass over the pixels, skipping values that are not finite.
+    :param (np.ndarray) labels: Labels of the pixels, from the label raster.
+    :param (dict) values: Arrays of the values of the pixels by name, as the labels.
+    :param (int) num_polygons: Number of polygons in the layer.
+    :return: (dict) Means by name, arrays indexed by the position of the polygon, NaN for polygons without pixels.
+    """
+    means = {}
+    for name, value in values.items():
+        finite = np.isfinite(value)
+        counts = np.bincount(labels[finite], minlength=num_polygons + 1)[1:]
+        sums = np.bincount(labels[finite], weights=value[finite], minlength=num_polygons + 1)[1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[name] = sums / counts
+    return means
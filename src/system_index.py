@@ -0,0 +1,54 @@
+# Decode the system:index of the rows exported from earth engine into compact columns
+#
+# Landsat {system:index} format -> {Point ID}_{Sensor}_{Tile ID}_{Acquired Date}, e.g. 12_LE07_122044_20010615
+# MODIS {system:index} format -> {Point ID}_{Acquired Year}_{Acquired Month}_{Acquired Day}, e.g. 12_2001_06_15
+# The column is parsed with one regular expression in PyArrow, into an int32 point ID, categorical (dictionary
+# encoded) sensor and tile, and dates stored as int32 day numbers since 1970-01-01 (date32), instead of
+# a frame of Python strings with one column per part. Shared by arrange_ee_tables.py and add_location_property.py.
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SYSTEM_INDEX_PATTERNS = {
+    'Landsat': r'^(?P<pointID>\d+)_(?P<sensor>[^_]+)_(?P<tile>[^_]+)_(?P<date>\d{8})$',
+    'MODIS': r'^(?P<pointID>\d+)_(?P<date>\d{4}_\d{2}_\d{2})$'
+}
+DATE_FORMATS = {
+    'Landsat': '%Y%m%d',
+    'MODIS': '%Y_%m_%d'
+}
+
+# type of the categorical columns, a table holds a few sensors, tiles and indices
+CATEGORY_TYPE = pa.dictionary(pa.int16(), pa.string())
+
+
+def decode_system_index(system_index, satellite):
+    """
+    Parses point ID, acquired date, and for Landsat sensor and tile ID, from the system:index of the rows.
+    :param (pa.ChunkedArray) system_index: Strings of system:index.
+    :param (str) satellite: Landsat or MODIS.
+    :return: (dict) Columns by name, pointID (int32), sensor and tile (categorical, Landsat only),
+        and date (date32).
+    """
+    parts = pc.extract_regex(system_index, SYSTEM_INDEX_PATTERNS[satellite])
+    unmatched = parts.is_null()
+    if pc.any(unmatched).as_py():
+        example = pc.filter(system_index, unmatched)[0].as_py()
+        raise ValueError(f"{pc.sum(unmatched).as_py()} rows with system:index not in the {satellite} format, "
+                         f"e.g. {example}.")
+    columns = {'pointID': pc.struct_field(parts, 'pointID').cast(pa.int32())}
+    if satellite == "Landsat":
+        for name in ['sensor', 'tile']:
+            columns[name] = pc.struct_field(parts, name).dictionary_encode().cast(CATEGORY_TYPE)
+    columns['date'] = pc.strptime(pc.struct_field(parts, 'date'), format=DATE_FORMATS[satellite],
+                                  unit='s').cast(pa.date32())
+    return columns
+
+
+def get_category_column(value, num_rows):
+    """
+    :return: (pa.DictionaryArray) Categorical column holding the same value in every row.
+    """
+    return pa.DictionaryArray.from_arrays(pa.array(np.zeros(num_rows, dtype=np.int16)), pa.array([value]))
+
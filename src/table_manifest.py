@@ -0,0 +1,118 @@
+# Keep track of the export tables already arranged, so that a run only reads the new or changed ones
+#
+# The manifest is a JSON file in the output folder of arrange_ee_tables.py or add_location_property.py,
+# with one entry per export table:
+# {
+#     "Mean_ndvi_1.csv": {
+#         "size": 123456,
+#         "mtime_ns": 1714550400000000000,
+#         "sha1": "...",
+#         "outputs": ["vi=ndvi/year=2001/Mean_ndvi_1-0.parquet", ...],   (relative to the output folder)
+#         "rows": 1000,                 (rows written)
+#         "bytes_read": 60000,          (size of the table as read, in memory)
+#         "bytes_arranged": 25000,      (size of the rows written, in memory)
+#         "updated": "2024-05-01T12:00:00"
+#     }
+# }
+# A table is taken as unchanged while its size and modification time are the same. Otherwise its content is
+# hashed, so a table synced again from Drive without changes is not arranged again either. The outputs of a
+# changed table are overwritten, and those it does not write any more are deleted.
+# The name starts with an underscore, so readers of Parquet datasets skip the manifest.
+
+import os
+import time
+import hashlib
+from extraction_manifest import load_run_manifest, save_run_manifest
+
+MANIFEST_NAME = '_manifest.json'
+
+# summary of a table returned by the arrange function of update_table()
+SUMMARY_KEYS = ['rows', 'bytes_read', 'bytes_arranged']
+
+
+def load_table_manifest(path_to_output):
+    """
+    :param (str) path_to_output: Output folder holding the manifest.
+    :return: (dict) Entries by table name, empty for a new folder.
+    """
+    return load_run_manifest(os.path.join(path_to_output, MANIFEST_NAME))
+
+
+def save_table_manifest(manifest, path_to_output):
+    save_run_manifest(manifest, os.path.join(path_to_output, MANIFEST_NAME))
+
+
+def get_file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_table_unchanged(entry, path_to_table):
+    """
+    Compares the size and modification time of a table with its entry, without reading the table.
+    :param (dict) entry: Entry of the table in the manifest, None for a new table.
+    :param (str) path_to_table: Path to the table.
+    :return: (bool)
+    """
+    if not entry:
+        return False
+    stat = os.stat(path_to_table)
+    return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+
+def update_table(path_to_table, entry, arrange, path_to_output, force=False):
+    """
+    Arranges a table unless its content is the one in its entry, and deletes the outputs of the entry
+    that the table does not write any more.
+    :param (str) path_to_table: Path to the table.
+    :param (dict) entry: Entry of the table in the manifest, None for a new table.
+    :param arrange: Function taking the path to the table, returning the paths to the outputs, relative to the
+        output folder, and the summary of the table (rows, bytes_read and bytes_arranged).
+    :param (str) path_to_output: Output folder.
+    :param (bool) force: Whether to arrange the table even if its content is unchanged.
+    :return: (tuple) Whether the table was arranged, and the new entry of the table.
+    """
+    stat = os.stat(path_to_table)
+    sha1 = get_file_hash(path_to_table)
+    if entry and entry['sha1'] == sha1 and not force:
+        arranged = False
+        outputs = entry['outputs']
+        summary = {key: entry.get(key) for key in SUMMARY_KEYS}
+    else:
+        arranged = True
+        outputs, summary = arrange(path_to_table)
+        for output in set(entry['outputs'] if entry else []) - set(outputs):
+            if os.path.exists(os.path.join(path_to_output, output)):
+                os.remove(os.path.join(path_to_output, output))
+    return arranged, {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': sha1,
+        'outputs': outputs,
+        **summary,
+        'updated': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def report_bytes_per_row(entries):
+    """
+    Prints the size in memory per row of the tables as read and as arranged.
+    :param (list) entries: Entries of the tables in the manifest.
+    """
+    num_rows = sum(entry.get('rows') or 0 for entry in entries)
+    if num_rows == 0:
+        return
+    bytes_read = sum(entry.get('bytes_read') or 0 for entry in entries)
+    bytes_arranged = sum(entry.get('bytes_arranged') or 0 for entry in entries)
+    print(f">> {num_rows} rows, {bytes_read / num_rows:.1f} bytes per row as read, "
+          f"{bytes_arranged / num_rows:.1f} bytes per row arranged.")
+
+
+def ask_incremental():
+    ask = input("-- Arrange new or changed tables only? (Y/N): ").strip().upper()
+    if ask in ("Y", "N"):
+        return ask == "Y"
+    return ask_incremental()
@@ -1,6 +1,7 @@
 import ee
 import time
 import logging
+from export_scheduler import EarthEngineBackend, run_export_jobs
 
 # Initialize GEE
 ee.Initialize()
@@ -11,21 +12,22 @@ logging.basicConfig(level=logging.INFO)
 
 def log_task_times(task_description):
     start_time = time.time()
-    task = ee.batch.Export.table.toDrive(
-        collection=ee.FeatureCollection([]),  # Placeholder collection
-        description=task_description,
-        fileFormat='CSV'
-    )
-    task.start()
+    job = {
+        'name': task_description,
+        'make_task': lambda: ee.batch.Export.table.toDrive(
+            collection=ee.FeatureCollection([]),  # Placeholder collection
+            description=task_description,
+            fileFormat='CSV'
+        )
+    }
     logging.info(f"Task '{task_description}' started at {time.ctime(start_time)}")
 
-    while task.active():
-        time.sleep(5)  # Check status every 5 seconds
-        logging.info(f"Checking task '{task_description}' status...")
+    # the scheduler polls the status with a growing delay, from 5 seconds
+    state = run_export_jobs([job], EarthEngineBackend(), max_in_flight=1)[task_description]
 
     end_time = time.time()
     elapsed_time = end_time - start_time
-    logging.info(f"Task '{task_description}' completed at {time.ctime(end_time)}, "
+    logging.info(f"Task '{task_description}' {state.lower()} at {time.ctime(end_time)}, "
                  f"duration: {elapsed_time / 60:.2f} minutes")
 
     return elapsed_time